@@ -1,7 +1,9 @@
 from app.routes.auth_routes import auth_bp
 from app.routes.data_routes import data_bp
+from app.routes.metrics_routes import metrics_bp
 
 def register_blueprints(app):
     
     app.register_blueprint(auth_bp, url_prefix='/api')
     app.register_blueprint(data_bp, url_prefix='/api')
+    app.register_blueprint(metrics_bp)
@@ -13,4 +13,16 @@ class Config:
     SQLALCHEMY_DATABASE_URI = os.getenv('DATABASE_URL')
     SQLALCHEMY_TRACK_MODIFICATIONS = False
     REDIS_URL = os.getenv('REDIS_URL')
-    RATELIMIT_STORAGE_URL = REDIS_URL
\ No newline at end of file
+    RATELIMIT_STORAGE_URL = REDIS_URL
+    CLUSTER_DEADLINE_SECONDS = float(os.getenv('CLUSTER_DEADLINE_SECONDS', 5))
+    # Places; larger /cluster inputs run as jobs that clients must poll at /api/cluster-jobs/<id>.
+    # 0 (the default) disables jobs; the bundled frontend does not poll yet.
+    CLUSTER_JOB_THRESHOLD = int(os.getenv('CLUSTER_JOB_THRESHOLD', 0))
+    CLUSTER_JOB_DEADLINE_SECONDS = float(os.getenv('CLUSTER_JOB_DEADLINE_SECONDS', 60))
+    GOOGLE_PLACES_API_URL = os.getenv('GOOGLE_PLACES_API_URL')  # Defaults to Google; point at tools/stub_places_server.py offline
+    PLACES_TIMEOUT_SECONDS = float(os.getenv('PLACES_TIMEOUT_SECONDS', 10))
+    PLACES_MAX_CONCURRENCY = int(os.getenv('PLACES_MAX_CONCURRENCY', 5))
+    PLACES_USER_CALL_BUDGET = int(os.getenv('PLACES_USER_CALL_BUDGET', 0))  # Upstream calls per user per window; 0 disables
+    PLACES_BUDGET_WINDOW_SECONDS = int(os.getenv('PLACES_BUDGET_WINDOW_SECONDS', 3600))
+    METRICS_TOKEN = os.getenv('METRICS_TOKEN')  # Bearer token for /metrics; unset disables the endpoint
+    PLACES_REDIS_SINGLE_FLIGHT = os.getenv('PLACES_REDIS_SINGLE_FLIGHT', 'true').lower() == 'true'  # Needs REDIS_URL
\ No newline at end of file
@@ -1,16 +1,31 @@
-from flask import jsonify
-from app.services.search_service import perform_search
-from app.services.cluster_service import perform_clustering
+from flask import jsonify, Response, stream_with_context, current_app, url_for
+from concurrent.futures import wait
+from app.services.search_service import perform_search, iter_search, check_places_budget
+from app.services.cluster_service import perform_clustering, places_cache_key, get_cached_scores, select_best_clusters
+from app.services.cluster_jobs import cluster_jobs, job_failed, job_error, CLUSTER_JOB_DEADLINE
+from app.services.pipeline_service import search_and_cluster
 import numpy as np
+import json, math
 from app.models import User
+from app.metrics import cluster_span
+from app.services.compact_format import negotiate_compact, compact_places, compact_clusters, compact_response
+from app.services.state_service import (
+    save_user_search, save_user_clusters, state_etag, get_state_version, get_state_blob
+)
 from app.extensions import db
 
 MILES_TO_METERS = 1609.34
+MAX_JOB_WAIT = 30  # seconds a cluster job poll may block with ?wait=
 
 # Example search_params structure: 
     # data:  {'placeNames': ['starbucks', 'chipotle'], 
     # 'searchCenter': {'lat': 47.608013, 'lng': -122.335167}, 
     # 'searchRadius': 5}
+# Streams NDJSON when requested with ?stream=1 or Accept: application/x-ndjson:
+# one {"placeName", "places"} line per place name as soon as it is refined,
+# then a final {"done": true, "count"} line once the search has been saved.
+# Accept: application/vnd.pcz.compact+json or application/x-msgpack returns a
+# columnar place table instead (see compact_format).
 def search_places(user_info, request):
     search_params = request.json
     if not search_params:
@@ -19,23 +34,61 @@ def search_places(user_info, request):
     placeNames = search_params.get('placeNames', [])
     searchCenter = search_params.get('searchCenter', {})
     searchRadius = search_params.get('searchRadius', 0) * MILES_TO_METERS
-    maxPageResults = 20 #20 max...if you want more you use the nextPageToken for the next page results
+    maxPageResults = 20 #20 max per page; perform_search follows nextPageToken and tiles dense areas
 
     if not placeNames or not searchCenter or not searchRadius:
         return jsonify({'error': 'Invalid data structure'}), 400
 
+    budget_response = places_budget_response(user_info, placeNames)
+    if budget_response:
+        return budget_response
+
+    if wants_stream(request):
+        return stream_search(user_info, placeNames, searchCenter, searchRadius, search_params.get('searchRadius'), maxPageResults)
+
     results = perform_search(placeNames, searchCenter, searchRadius, maxPageResults)
     # return jsonify(results), 200
+    save_search(user_info, results, searchCenter, search_params.get('searchRadius'))
+
+    compact_mimetype = negotiate_compact(request)
+    if compact_mimetype:
+        return compact_response(compact_places(results), compact_mimetype), 200
+    return jsonify(results), 200
+
+# 429 when the user's Places call budget cannot cover at least one call per name
+def places_budget_response(user_info, placeNames):
+    retry_after = check_places_budget(user_info['sub'], len(placeNames))
+    if retry_after:
+        response = jsonify({'error': 'Places call budget exceeded, try again later'})
+        response.headers['Retry-After'] = str(retry_after)
+        return response, 429
+    return None
+
+def wants_stream(request):
+    return request.args.get('stream') == '1' or request.accept_mimetypes.best == 'application/x-ndjson'
+
+def stream_search(user_info, placeNames, searchCenter, searchRadius, searchRadiusMiles, maxPageResults):
+    def generate():
+        results_by_index = {}
+        for index, placeName, results in iter_search(placeNames, searchCenter, searchRadius, maxPageResults):
+            results_by_index[index] = results
+            yield json.dumps({'placeName': placeName, 'places': results}) + '\n'
+
+        # Persist once, in the order the place names were given
+        results = [place for index in sorted(results_by_index) for place in results_by_index[index]]
+        save_search(user_info, results, searchCenter, searchRadiusMiles)
+        yield json.dumps({'done': True, 'count': len(results)}) + '\n'
+
+    return Response(stream_with_context(generate()), mimetype='application/x-ndjson')
+
+# Clusters default to empty, clearing those analyzed from the previous data
+def save_search(user_info, results, searchCenter, searchRadiusMiles, clusters=None):
     user = User.query.filter_by(id=user_info['sub']).first()
 
     if user:
-        user.searched_places = results
-        user.search_center = searchCenter
-        user.search_radius = search_params.get('searchRadius')
-        user.clusters = [] # Clear clusters which were analyzed to the previous data
-        db.session.commit()
-
-    return jsonify(results), 200
+        save_user_search(user, results, searchCenter, searchRadiusMiles, clusters)
+        with cluster_span('db_commit'):
+            db.session.commit()
 
 # Example places structure:
 # [
@@ -48,6 +101,11 @@ def search_places(user_info, request):
 # ]
 # Example user_preference structure:
 # 0, .25, .5, .75, 1 (One of them)
+# Supports the same compact Accept types as search_places, with clusters as
+# index lists into the place table.
+# Inputs of CLUSTER_JOB_THRESHOLD places or more that are not cached run as a
+# background job instead: the reply is 202 {"jobId", "status"} with a Location
+# to poll (see cluster_job).
 def cluster_data(user_info, request):
     places = request.json
     if not places:
@@ -61,19 +119,130 @@ def cluster_data(user_info, request):
     if not place_names or not place_latlngs.all():
         return jsonify({'error': 'Invalid data structure'}), 400
 
-    clusters = perform_clustering(places, place_names, place_latlngs, user_preference)
+    job_threshold = current_app.config.get('CLUSTER_JOB_THRESHOLD', 0)
+    if job_threshold and len(places) >= job_threshold and get_cached_scores(places_cache_key(places)) is None:
+        job_id = cluster_jobs.submit(places, user_info['sub'],
+                                     current_app.config.get('CLUSTER_JOB_DEADLINE_SECONDS', CLUSTER_JOB_DEADLINE))
+        return job_pending_response(job_id)
 
-    user = User.query.filter_by(id=user_info['sub']).first()
+    clusters, report = perform_clustering(places, place_names, place_latlngs, user_preference)
+    save_clusters(user_info, clusters)
+    return cluster_response(request, clusters, report), 200
 
-    if user:
-        user.clusters = clusters
-        db.session.commit()
+# Polls a cluster job. ?wait=<seconds> (up to MAX_JOB_WAIT) holds the request
+# until the job finishes. Pending jobs reply 202; finished ones apply the
+# User-Preference header, save the clusters and reply like cluster_data.
+def cluster_job(user_info, request, job_id):
+    job = cluster_jobs.get(job_id, user_info['sub'])
+    if job is None:
+        return jsonify({'error': 'Cluster job not found'}), 404
+
+    try:
+        wait_seconds = float(request.args.get('wait', 0))
+    except ValueError:
+        return jsonify({'error': 'wait must be a number of seconds'}), 400
+    if not math.isfinite(wait_seconds):
+        return jsonify({'error': 'wait must be a number of seconds'}), 400
+    wait_seconds = min(wait_seconds, MAX_JOB_WAIT)
+
+    future = job['future']
+    if wait_seconds > 0:
+        wait([future], timeout=wait_seconds)
 
-    return jsonify(clusters), 200
+    if not future.done():
+        return job_pending_response(job_id)
+    if job_failed(future):
+        return jsonify({'jobId': job_id, 'status': 'failed', 'error': job_error(future)}), 500
 
-def latest_state(user_info):
+    scored_by_method, report = future.result()
+    best_method, clusters = select_best_clusters(scored_by_method, float(request.headers.get('User-Preference')))
+    report = dict(report, cached=False, best_method=best_method)
+    save_clusters(user_info, clusters)
+    return cluster_response(request, clusters, report), 200
+
+def job_pending_response(job_id):
+    response = jsonify({'jobId': job_id, 'status': 'pending'})
+    response.headers['Location'] = url_for('data.cluster_job_route', job_id=job_id)
+    return response, 202
+
+def save_clusters(user_info, clusters):
     user = User.query.filter_by(id=user_info['sub']).first()
+
     if user:
-        return jsonify({'clusters_state':user.clusters, 'searched_places_state':user.searched_places, 'center_state':user.search_center, 'radius_state':user.search_radius}), 200
+        save_user_clusters(user, clusters)
+        with cluster_span('db_commit'):
+            db.session.commit()
+
+def cluster_response(request, clusters, report):
+    compact_mimetype = negotiate_compact(request)
+    if compact_mimetype:
+        response = compact_response(compact_clusters(clusters), compact_mimetype)
     else:
-        return jsonify({'error': 'User not found; no previous state.'}), 400
\ No newline at end of file
+        response = jsonify(clusters)
+    set_cluster_headers(response, report)
+    return response
+
+def set_cluster_headers(response, report):
+    response.headers['X-Cluster-Method'] = report['best_method'] or ''
+    response.headers['X-Cluster-Finished'] = ','.join(report['finished'])
+    response.headers['X-Cluster-Timed-Out'] = ','.join(report['timed_out'])
+    response.headers['X-Cluster-Cache'] = 'hit' if report['cached'] else 'miss'
+
+# Same body as search_places plus the User-Preference header of cluster_data.
+# Searches and clusters server-side, saves both in one commit and returns
+# {"places": [...], "clusters": [...]}.
+def search_and_cluster_places(user_info, request):
+    search_params = request.json
+    if not search_params:
+        return jsonify({'error': 'No data provided'}), 400
+
+    placeNames = search_params.get('placeNames', [])
+    searchCenter = search_params.get('searchCenter', {})
+    searchRadius = search_params.get('searchRadius', 0) * MILES_TO_METERS
+    maxPageResults = 20
+    user_preference = float(request.headers.get('User-Preference'))
+
+    if not placeNames or not searchCenter or not searchRadius:
+        return jsonify({'error': 'Invalid data structure'}), 400
+
+    budget_response = places_budget_response(user_info, placeNames)
+    if budget_response:
+        return budget_response
+
+    places, clusters, report = search_and_cluster(placeNames, searchCenter, searchRadius, maxPageResults, user_preference)
+    save_search(user_info, places, searchCenter, search_params.get('searchRadius'), clusters)
+
+    compact_mimetype = negotiate_compact(request)
+    if compact_mimetype:
+        response = compact_response(compact_clusters(clusters, places), compact_mimetype)
+    else:
+        response = jsonify({'places': places, 'clusters': clusters})
+    if report is not None:
+        set_cluster_headers(response, report)
+    return response, 200
+
+# Conditional GET: the ETag is the user's state version, so a matching
+# If-None-Match gets a 304 after reading only that version
+def latest_state(user_info, request):
+    user_id = user_info['sub']
+    version = get_state_version(user_id)
+    if version is None:
+        return jsonify({'error': 'User not found; no previous state.'}), 400
+
+    etag = state_etag(user_id, version)
+    if etag in request.if_none_match:
+        response = Response(status=304)
+    else:
+        blob = get_state_blob(user_id, version)
+        if blob is None:
+            return jsonify({'error': 'User not found; no previous state.'}), 400
+        etag, body, compressed = blob
+        response = Response(body, mimetype='application/json')
+        if compressed is not None and 'gzip' in request.accept_encodings:
+            response.set_data(compressed)
+            response.headers['Content-Encoding'] = 'gzip'
+
+    response.set_etag(etag)
+    response.headers['Cache-Control'] = 'private, no-cache'
+    response.vary.update(['Authorization', 'Accept-Encoding'])
+    return response
\ No newline at end of file
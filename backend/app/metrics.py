@@ -0,0 +1,124 @@
+from contextlib import contextmanager
+import bisect, threading, time
+
+# Minimal in-process metrics, rendered in the Prometheus text exposition format
+# at /metrics. Values are per worker process; scrape every worker (or sum them).
+# Labels only take values from small fixed sets: never user ids or search text,
+# which would publish them and grow the registry without bound.
+DEFAULT_BUCKETS = (0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+registry = []
+
+def escape_label(value):
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+def format_labels(labelnames, labelvalues, extra=()):
+    pairs = list(zip(labelnames, labelvalues)) + list(extra)
+    if not pairs:
+        return ''
+    return '{' + ','.join(f'{name}="{escape_label(value)}"' for name, value in pairs) + '}'
+
+def format_value(value):
+    if value == float('inf'):
+        return '+Inf'
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+class Counter:
+    def __init__(self, name, documentation, labelnames=()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self.values = {}
+        self.lock = threading.Lock()
+        registry.append(self)
+
+    def inc(self, amount=1, **labels):
+        key = tuple(labels[name] for name in self.labelnames)
+        with self.lock:
+            self.values[key] = self.values.get(key, 0) + amount
+
+    def value(self, **labels):
+        key = tuple(labels[name] for name in self.labelnames)
+        with self.lock:
+            return self.values.get(key, 0)
+
+    def collect(self):
+        lines = [f'# HELP {self.name} {self.documentation}', f'# TYPE {self.name} counter']
+        with self.lock:
+            for key, value in sorted(self.values.items()):
+                lines.append(f'{self.name}{format_labels(self.labelnames, key)} {format_value(value)}')
+        return lines
+
+class Histogram:
+    def __init__(self, name, documentation, labelnames=(), buckets=DEFAULT_BUCKETS):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self.buckets = tuple(sorted(buckets))
+        self.values = {}  # labels -> [per-bucket counts (+Inf last), sum]
+        self.lock = threading.Lock()
+        registry.append(self)
+
+    def observe(self, value, **labels):
+        key = tuple(labels[name] for name in self.labelnames)
+        index = bisect.bisect_left(self.buckets, value)
+        with self.lock:
+            counts, total = self.values.get(key) or ([0] * (len(self.buckets) + 1), 0)
+            counts[index] += 1
+            self.values[key] = (counts, total + value)
+
+    def collect(self):
+        lines = [f'# HELP {self.name} {self.documentation}', f'# TYPE {self.name} histogram']
+        with self.lock:
+            for key, (counts, total) in sorted(self.values.items()):
+                cumulative = 0
+                for bound, count in zip(self.buckets + (float('inf'),), counts):
+                    cumulative += count
+                    labels = format_labels(self.labelnames, key, [('le', format_value(float(bound)))])
+                    lines.append(f'{self.name}_bucket{labels} {cumulative}')
+                labels = format_labels(self.labelnames, key)
+                lines.append(f'{self.name}_sum{labels} {format_value(float(total))}')
+                lines.append(f'{self.name}_count{labels} {cumulative}')
+        return lines
+
+# Observes the wall time of the with-block on the histogram
+@contextmanager
+def timed(histogram, **labels):
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        histogram.observe(time.perf_counter() - start, **labels)
+
+def render():
+    return '\n'.join(line for metric in registry for line in metric.collect()) + '\n'
+
+# Places API (New) Text Search calls
+places_calls = Counter('places_calls_total', 'Upstream Places calls.')
+places_call_latency = Histogram('places_call_latency_seconds', 'Upstream Places call latency.', ('outcome',))
+places_call_errors = Counter('places_call_errors_total', 'Failed upstream Places calls by kind.', ('kind',))
+places_page_results = Histogram('places_page_results', 'Places returned per upstream page.',
+                                buckets=(0, 1, 5, 10, 15, 20))
+places_fetches = Counter('places_fetches_total', 'Rectangle fetches, by whether they saturated (split or cut off).',
+                         ('saturated',))
+places_budget_rejections = Counter('places_budget_rejections_total', 'Searches and upstream calls refused by the per-user call budget.')
+
+# Clustering: per-stage spans (eps, dbscan_fit, kmeans_fit, enumeration,
+# local_search, scoring, selection, db_commit), whole strategies, and outcomes.
+# Background cluster jobs record theirs in the job worker processes.
+STAGE_BUCKETS = (0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+cluster_stage_seconds = Histogram('cluster_stage_seconds', 'Time spent per clustering stage.', ('stage',),
+                                  buckets=STAGE_BUCKETS)
+cluster_strategy_seconds = Histogram('cluster_strategy_seconds', 'Time per clustering strategy, scoring included.',
+                                     ('method',), buckets=STAGE_BUCKETS)
+cluster_candidates = Histogram('cluster_candidates', 'Scored candidate clusters per strategy run.', ('method',),
+                               buckets=(0, 1, 10, 100, 1000, 10000, 100000))
+cluster_strategy_outcomes = Counter('cluster_strategy_outcomes_total', 'Strategy runs by outcome.',
+                                    ('method', 'outcome'))
+cluster_best_method = Counter('cluster_best_method_total', 'Winning strategy per clustering request.', ('method',))
+cluster_requests = Counter('cluster_requests_total', 'Clustering requests by scored-candidate cache result.',
+                           ('cache',))
+
+def cluster_span(stage):
+    return timed(cluster_stage_seconds, stage=stage)
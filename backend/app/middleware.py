@@ -1,11 +1,11 @@
-from flask import jsonify, current_app, request
+from flask import jsonify, current_app, request, g
 from google.auth.transport.requests import Request
 from google.oauth2 import id_token
 from functools import wraps
 import cachecontrol, requests, datetime
-from app.models import User, Session
+from app.models import User
 from app.extensions import db
-import time
+from app.services.auth_service import get_cached_claims, cache_claims, session_is_valid
 
 # Cached session setup for Google token verification
 session = requests.session()
@@ -21,15 +21,18 @@ def session_required(f):
         token = auth_header.split(' ')[1]
 
         try:
-            user_info = id_token.verify_oauth2_token(token, request_adapter, current_app.config['GOOGLE_CLIENT_ID'])
-            
-            session_record = Session.query.filter_by(user_id=user_info['sub']).first()
+            # Signature checks and session lookups are cached (see auth_service)
+            user_info = get_cached_claims(token)
+            if user_info is None:
+                user_info = id_token.verify_oauth2_token(token, request_adapter, current_app.config['GOOGLE_CLIENT_ID'])
+                cache_claims(token, user_info)
 
-            if not session_record or session_record.expiration < int(time.time()):
+            if not session_is_valid(user_info['sub']):
                 return jsonify({'authenticated': False, 'message': 'Session expired or invalid'}), 401
 
         except ValueError as error:
             return jsonify({'authenticated': False,'message': 'Token is invalid or expired', 'error': str(error)}), 401
 
+        g.user_id = user_info['sub']  # For per-user accounting further down the request
         return f(user_info, *args, **kwargs)
     return session_authenticator
\ No newline at end of file
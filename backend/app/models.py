@@ -1,15 +1,18 @@
 from app.extensions import db
-from sqlalchemy import ForeignKey, JSON
+from sqlalchemy import ForeignKey, JSON, LargeBinary
 from sqlalchemy.orm import Mapped, mapped_column
 
 class User(db.Model):
     id: Mapped[str] = mapped_column(primary_key=True, unique=True, nullable=False)
-    searched_places: Mapped[list] = mapped_column(JSON, nullable=False, default=list)
-    clusters: Mapped[list] = mapped_column(JSON, nullable=False, default=list)
+    # Packed searched places and clusters; read and write them through app.services.state_service
+    places_data: Mapped[bytes] = mapped_column(LargeBinary, nullable=True)
+    clusters_data: Mapped[bytes] = mapped_column(LargeBinary, nullable=True)
     search_center: Mapped[dict] = mapped_column(JSON, nullable=False, default={
     'lat': 47.608013,
     'lng': -122.335167,})
     search_radius: Mapped[int] = mapped_column(nullable=False, default=5)
+    # Bumped on every saved search or clustering; the ETag of /latest-state
+    state_version: Mapped[int] = mapped_column(nullable=False, default=0, server_default='0')
 
 class Session(db.Model):
     id: Mapped[str] = mapped_column(primary_key=True, unique=True, nullable=False)
@@ -1,5 +1,5 @@
 from flask import Blueprint, request
-from app.controllers.data_controller import search_places, cluster_data, latest_state
+from app.controllers.data_controller import search_places, cluster_data, cluster_job, search_and_cluster_places, latest_state
 from app.middleware import session_required
 from app.limiter import limiter
 
@@ -17,8 +17,20 @@ def search_places_route(user_info):
 def cluster_route(user_info):
     return cluster_data(user_info, request)
 
+@data_bp.route('/cluster-jobs/<job_id>', methods=['GET'])
+@limiter.limit("60 per minute")
+@session_required
+def cluster_job_route(user_info, job_id):
+    return cluster_job(user_info, request, job_id)
+
+@data_bp.route('/search-and-cluster', methods=['POST'])
+@limiter.limit("10 per minute")
+@session_required
+def search_and_cluster_route(user_info):
+    return search_and_cluster_places(user_info, request)
+
 @data_bp.route('/latest-state', methods=['GET'])
 @limiter.limit("20 per minute")
 @session_required
 def latest_state_route(user_info):
-    return latest_state(user_info)
\ No newline at end of file
+    return latest_state(user_info, request)
\ No newline at end of file
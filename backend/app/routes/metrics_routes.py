@@ -0,0 +1,18 @@
+from flask import Blueprint, Response, current_app, jsonify, request
+from app.metrics import render
+import hmac
+
+metrics_bp = Blueprint('metrics', __name__)
+
+# Prometheus scrape endpoint for this worker's metrics. Scrapers authenticate
+# with Authorization: Bearer <METRICS_TOKEN>; without a configured token the
+# endpoint is disabled.
+@metrics_bp.route('/metrics', methods=['GET'])
+def metrics():
+    token = current_app.config.get('METRICS_TOKEN')
+    if not token:
+        return jsonify({'error': 'Not found'}), 404
+    auth_header = request.headers.get('Authorization', '')
+    if not hmac.compare_digest(auth_header.encode(), f'Bearer {token}'.encode()):
+        return jsonify({'error': 'Unauthorized'}), 401
+    return Response(render(), mimetype='text/plain; version=0.0.4')
@@ -2,6 +2,53 @@ from app.models import User, Session
 from app.extensions import db
 from  datetime import datetime, timedelta
 from flask import jsonify
+from cachetools import TLRUCache, TTLCache
+import hashlib, threading, time
+
+# Verified id_token claims keyed by token hash, each kept until the token's exp,
+# so session_required only verifies a token's signature once
+TOKEN_CACHE_SIZE = 4096
+token_cache = TLRUCache(maxsize=TOKEN_CACHE_SIZE, ttu=lambda _, claims, now: claims['exp'], timer=time.time)
+token_cache_lock = threading.Lock()
+
+# user_id -> expiration of a session found valid in the database. The short TTL
+# bounds how long another worker keeps accepting a session removed elsewhere.
+SESSION_CACHE_SIZE = 4096
+SESSION_CACHE_TTL = 30  # seconds
+session_cache = TTLCache(maxsize=SESSION_CACHE_SIZE, ttl=SESSION_CACHE_TTL)
+session_cache_lock = threading.Lock()
+
+def token_hash(token):
+    return hashlib.sha256(token.encode()).hexdigest()
+
+def get_cached_claims(token):
+    with token_cache_lock:
+        return token_cache.get(token_hash(token))
+
+def cache_claims(token, claims):
+    with token_cache_lock:
+        token_cache[token_hash(token)] = claims
+
+# True while the user has an unexpired session; hits the database at most once per SESSION_CACHE_TTL
+def session_is_valid(user_id):
+    with session_cache_lock:
+        expiration = session_cache.get(user_id)
+    if expiration is None:
+        session = Session.query.filter_by(user_id=user_id).first()
+        if not session:
+            return False
+        expiration = session.expiration
+        with session_cache_lock:
+            session_cache[user_id] = expiration
+    return expiration >= int(time.time())
+
+# Drops this worker's cached claims and session validity for the user
+def invalidate_auth_cache(user_id):
+    with session_cache_lock:
+        session_cache.pop(user_id, None)
+    with token_cache_lock:
+        for key in [key for key, claims in token_cache.items() if claims['sub'] == user_id]:
+            token_cache.pop(key, None)
 
 def add_user(user_id):
     # print(f'User ID: {user_id}, type: {type(user_id)}')
@@ -36,6 +83,7 @@ def add_session(session_id, user_id, session_exp):
     )
     db.session.add(session)
     db.session.commit()
+    invalidate_auth_cache(user_id)
     print(f'Added Session {session_id} for user {user_id}, expires on {datetime.fromtimestamp(session_exp)}')
 
 
@@ -51,6 +99,7 @@ def remove_session(session_id):
     if session:
         db.session.delete(session)
         db.session.commit()
+        invalidate_auth_cache(session.user_id)
         print(f'Removed Session {session_id}')
         return True
     else:
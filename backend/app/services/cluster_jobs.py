@@ -0,0 +1,81 @@
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from cachetools import TTLCache
+import multiprocessing, threading, time
+import numpy as np
+from app.services.cluster_service import places_cache_key, run_strategies, cache_scores
+
+# Background clustering for large /cluster inputs. Jobs run run_strategies in a
+# pool of worker processes (spawned, so they share no Flask or sklearn state
+# with the web worker) and are keyed by the places hash, so identical inputs
+# share one job. Results are preference-independent scored candidates; each
+# poll applies the caller's preference. This is the in-process backend: jobs
+# live in the web worker that accepted them, so polls must reach that worker.
+CLUSTER_JOB_WORKERS = 2
+CLUSTER_JOB_DEADLINE = 60.0  # seconds given to the strategies of one job
+CLUSTER_JOB_CACHE_SIZE = 256
+CLUSTER_JOB_TTL = 1800  # seconds a job (and its result) is kept
+
+# Runs in a worker process
+def run_cluster_job(places, deadline):
+    place_names = [place['name'] for place in places]
+    place_latlngs = np.array([[place['lat'], place['lng']] for place in places])
+    return run_strategies(places, place_names, place_latlngs, deadline)
+
+class LocalJobQueue:
+    def __init__(self, max_workers=CLUSTER_JOB_WORKERS, maxsize=CLUSTER_JOB_CACHE_SIZE, ttl=CLUSTER_JOB_TTL):
+        self.max_workers = max_workers
+        self.executor = None
+        self.jobs = TTLCache(maxsize=maxsize, ttl=ttl)
+        self.lock = threading.Lock()
+
+    def get_executor(self):
+        if self.executor is None:
+            self.executor = ProcessPoolExecutor(max_workers=self.max_workers,
+                                                mp_context=multiprocessing.get_context('spawn'))
+        return self.executor
+
+    # Returns the job id for the places, starting a job unless an identical one
+    # is already queued, running or done. user_id is recorded as allowed to poll it.
+    def submit(self, places, user_id, deadline=CLUSTER_JOB_DEADLINE):
+        job_id = places_cache_key(places)
+        with self.lock:
+            job = self.jobs.get(job_id)
+            if job is None or job_failed(job['future']):
+                future = self.start(places, deadline)
+                job = self.jobs[job_id] = {'future': future, 'users': set(), 'created': time.time()}
+                future.add_done_callback(lambda done: self.finish(job_id, done))
+            job['users'].add(user_id)
+        return job_id
+
+    def start(self, places, deadline):
+        try:
+            return self.get_executor().submit(run_cluster_job, places, deadline)
+        except BrokenProcessPool:
+            # A worker process died; replace the pool once
+            self.executor = None
+            return self.get_executor().submit(run_cluster_job, places, deadline)
+
+    # Seeds the scored-candidate cache, so later /cluster calls for the same places are instant
+    def finish(self, job_id, future):
+        if job_failed(future):
+            print(f'Cluster job {job_id} failed: {job_error(future)}')
+            return
+        scored_by_method, report = future.result()
+        cache_scores(job_id, scored_by_method, report)
+
+    # The job's record, or None when it is unknown to this worker or not the user's
+    def get(self, job_id, user_id):
+        with self.lock:
+            job = self.jobs.get(job_id)
+        if job is None or user_id not in job['users']:
+            return None
+        return job
+
+def job_failed(future):
+    return future.done() and (future.cancelled() or future.exception() is not None)
+
+def job_error(future):
+    return 'cancelled' if future.cancelled() else str(future.exception())
+
+cluster_jobs = LocalJobQueue()
@@ -1,64 +1,189 @@
-from sklearn.cluster import KMeans, DBSCAN
+from sklearn.cluster import KMeans, MiniBatchKMeans, DBSCAN
 import numpy as np
-from itertools import combinations
-from app.utils import haversine_distance
-from sklearn.metrics import pairwise_distances
+from itertools import combinations, count
+from app.utils import haversine_distance, project_to_local_frame
+from sklearn.metrics import pairwise_distances_chunked
+from sklearn.neighbors import KDTree
+import time
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+from flask import current_app, has_app_context
+from cachetools import TTLCache
+from app.metrics import (
+    timed, cluster_span, cluster_strategy_seconds, cluster_candidates, cluster_strategy_outcomes,
+    cluster_best_method, cluster_requests
+)
+import hashlib, heapq, json, threading
+
+# Seconds perform_clustering waits for its strategies before returning the best
+# result scored so far. Overridden by CLUSTER_DEADLINE_SECONDS in the app config.
+# If none has finished by then, it waits up to CLUSTER_GRACE_FACTOR deadlines more
+# for the first one, then returns no clusters.
+CLUSTER_DEADLINE = 5.0
+CLUSTER_GRACE_FACTOR = 1.0
+STRATEGY_WORKERS = 8
+
+# Shared across requests so strategies that miss a deadline finish in the background
+strategy_pool = ThreadPoolExecutor(max_workers=STRATEGY_WORKERS, thread_name_prefix='cluster-strategy')
+
+# Reads a config value when running inside the Flask app, else falls back to the module default
+def get_setting(name, default):
+    if has_app_context():
+        return current_app.config.get(name, default)
+    return default
+
+# Scored candidate sets per places payload. They do not depend on the user's
+# preference, so a slider change only re-filters and re-ranks cached candidates.
+CLUSTER_CACHE_SIZE = 256
+CLUSTER_CACHE_TTL = 600  # seconds
+
+scored_cache = TTLCache(maxsize=CLUSTER_CACHE_SIZE, ttl=CLUSTER_CACHE_TTL)
+scored_cache_lock = threading.Lock()
+
+# Canonical, order-independent hash of the places payload
+def places_cache_key(places):
+    canonical = sorted((p['name'], p['lat'], p['lng']) for p in places)
+    return hashlib.sha256(json.dumps(canonical).encode()).hexdigest()
+
+# Returns (best_clusters, report) for the user's preference. Candidate sets come
+# from the cache when this payload was clustered before; otherwise every strategy
+# is run and, if all of them finished, the scored candidates are cached.
+# report names the winning method plus which strategies finished, failed or
+# were still running when the deadline expired.
+# planar and type_trees (see index_place_types) may be passed in when the caller
+# already built them, as the search-and-cluster pipeline does.
+def perform_clustering(places, place_names, place_latlngs, user_preference, deadline=None,
+                       planar=None, type_trees=None):
+    cache_key = places_cache_key(places)
+    scored_by_method = get_cached_scores(cache_key)
+
+    if scored_by_method is not None:
+        report = {'finished': list(scored_by_method), 'failed': [], 'timed_out': [], 'cached': True}
+    else:
+        scored_by_method, report = run_strategies(places, place_names, place_latlngs, deadline, planar, type_trees)
+        report['cached'] = False
+        cache_scores(cache_key, scored_by_method, report)
+    cluster_requests.inc(cache='hit' if report['cached'] else 'miss')
 
-def perform_clustering(places, place_names, place_latlngs, user_preference):
+    best_method, best_clusters = select_best_clusters(scored_by_method, user_preference)
+    report['best_method'] = best_method
 
-    place_types = set(place_names)  # Collect unique place names
-    max_clusters = dynamic_max_clusters(len(place_latlngs), place_types)
-    
-    print('place_types: ', place_types)
-    print('total_places: ', len(place_latlngs))
-    print('max_clusters: ', max_clusters)
+    return best_clusters, report
+
+def get_cached_scores(cache_key):
+    with scored_cache_lock:
+        return scored_cache.get(cache_key)
 
+# Only complete runs are cached, so a timed-out or failed strategy gets another chance
+def cache_scores(cache_key, scored_by_method, report):
+    if not report['timed_out'] and not report['failed']:
+        with scored_cache_lock:
+            scored_cache[cache_key] = scored_by_method
+
+# (best_method, best_clusters) across the strategies' scored candidates for the
+# preference; (None, []) when no strategy was scored
+def select_best_clusters(scored_by_method, user_preference):
     best_method = None
-    best_clusters = None
+    best_clusters = []
     best_score = float('-inf')
 
-    # Apply brute-force if feasible
-    if len(place_latlngs) <= 10 and len(place_types) <= 3:
-        # Use brute-force clustering for very small datasets
-        brute_force_clusters = brute_force_clustering(place_latlngs, places, place_types)
-        BF_valid_clusters, BF_Score = evaluate_clusters(brute_force_clusters, user_preference)
-        if BF_Score > best_score:
-            best_method = 'Brute Force'
-            best_clusters = BF_valid_clusters
-            best_score = BF_Score
-        print('DBSCAN BF_Score: ', BF_Score,'\n\n')
-    
-    # Apply DBSCAN
-    dbscan_clusters = dbscan_clustering(place_latlngs, places, place_types)
-    # print('DBSCAN CLUSTERS: ', dbscan_clusters,'\n\n')
-    DB_valid_clusters, DB_score = evaluate_clusters(dbscan_clusters, user_preference)
-    if DB_score > best_score:
-        best_method = 'DBScan'
-        best_clusters = DB_valid_clusters
-        best_score = DB_score
-    # print('DBSCAN VALID CLUSTERS: ', DB_valid_clusters,'\n\n')
-    print('DBSCAN DB_score: ', DB_score,'\n\n')
-    # Apply KMeans and iterative refinement
-    initial_labels = kmeans_clustering(place_latlngs, max_clusters)
-    kmeans_clusters = iterative_refinement(initial_labels, places, place_types)
-    # print('KMEANS CLUSTERS: ', kmeans_clusters)
-    KM_valid_clusters, KM_score = evaluate_clusters(kmeans_clusters, user_preference)
-    if KM_score > best_score:
-        best_method = 'KMeans'
-        best_clusters = KM_valid_clusters
-        best_score = KM_score
-    print('KMEANS SCORE: ', KM_score,'\n\n')
-    print('Best Method:', best_method)
-
-    return best_clusters
-
-# Initial clustering using KMeans
+    with cluster_span('selection'):
+        for method, scored_clusters in scored_by_method.items():
+            valid_clusters, score = select_clusters(scored_clusters, user_preference)
+            if score > best_score:
+                best_method = method
+                best_clusters = valid_clusters
+                best_score = score
+
+    if best_method is not None:
+        cluster_best_method.inc(method=best_method)
+    return best_method, best_clusters
+
+# Runs every applicable strategy concurrently and scores its candidates.
+# Returns ({method: scored_clusters}, report) with methods in tie-break order.
+def run_strategies(places, place_names, place_latlngs, deadline=None, planar=None, type_trees=None):
+    if deadline is None:
+        deadline = get_setting('CLUSTER_DEADLINE_SECONDS', CLUSTER_DEADLINE)
+
+    place_types = set(place_names)  # Collect unique place names
+    max_clusters = dynamic_max_clusters(len(place_latlngs), place_types)
+
+    # Project once into a local metric frame shared by the geometric strategies.
+    # Candidate scoring (and the exact solver, which prunes on it) stays in degrees
+    # so the preference thresholds keep their meaning.
+    if planar is None:
+        planar = project_to_local_frame(place_latlngs)
+
+    # Strategies in tie-break order: an earlier strategy wins on equal scores
+    strategies = {}
+    if len(place_latlngs) <= BRANCH_AND_BOUND_MAX_PLACES:
+        # Use the exact solver while it stays affordable
+        strategies['Branch and Bound'] = lambda: branch_and_bound_clustering(
+            place_latlngs, places, place_types, disjoint=not keeps_all_candidates(place_latlngs, place_types)
+        )
+    strategies['DBScan'] = lambda: dbscan_clustering(planar, places, place_types)
+    strategies['Nearest Neighbour'] = lambda: nearest_neighbour_clustering(planar, places, place_types, type_trees)
+    strategies['KMeans'] = lambda: iterative_refinement(
+        kmeans_clustering(planar, max_clusters), places, place_types, planar=planar
+    )
+
+    futures = {
+        method: strategy_pool.submit(run_strategy, method, strategy)
+        for method, strategy in strategies.items()
+    }
+    done, pending = wait(futures.values(), timeout=deadline)
+    if not done:
+        # Nothing scored in time; take whichever strategy finishes first within the grace period
+        done, pending = wait(pending, timeout=deadline * CLUSTER_GRACE_FACTOR, return_when=FIRST_COMPLETED)
+    for future in pending:
+        future.cancel()
+
+    scored_by_method = {}
+    report = {'finished': [], 'failed': [], 'timed_out': []}
+
+    for method, future in futures.items():
+        if future not in done:
+            report['timed_out'].append(method)
+            continue
+        try:
+            scored_by_method[method] = future.result()
+        except Exception as error:
+            print(f'{method} clustering failed: {error}')
+            report['failed'].append(method)
+            continue
+        report['finished'].append(method)
+
+    for outcome in ('finished', 'failed', 'timed_out'):
+        for method in report[outcome]:
+            cluster_strategy_outcomes.inc(method=method, outcome=outcome)
+
+    return scored_by_method, report
+
+# Runs one strategy and scores its candidates, timing both
+def run_strategy(method, strategy):
+    with timed(cluster_strategy_seconds, method=method):
+        candidates = strategy()
+        with cluster_span('scoring'):
+            scored = score_clusters(candidates)
+    cluster_candidates.observe(len(scored), method=method)
+    return scored
+
+# Inputs above this size are fit with MiniBatchKMeans to keep the fit time bounded
+KMEANS_MINIBATCH_THRESHOLD = 2000
+KMEANS_BATCH_SIZE = 1024
+
+# Initial clustering using KMeans, with a single k-means++ init
 def kmeans_clustering(coords, max_clusters):
-    kmeans = KMeans(n_clusters=max_clusters, random_state=0).fit(coords)
+    if len(coords) > KMEANS_MINIBATCH_THRESHOLD:
+        kmeans = MiniBatchKMeans(n_clusters=max_clusters, batch_size=KMEANS_BATCH_SIZE, n_init=1, random_state=0)
+    else:
+        kmeans = KMeans(n_clusters=max_clusters, n_init=1, random_state=0)
+    with cluster_span('kmeans_fit'):
+        kmeans.fit(coords)
     return kmeans.labels_
 
-# Refine clusters to ensure each cluster contains at least one of each place type
-def refine_clusters(labels, places, place_types):
+# Refine clusters to ensure each cluster contains at least one of each place type.
+# Enumeration stops early once the optional perf_counter() deadline passes.
+def refine_clusters(labels, places, place_types, deadline=None):
     clusters = {i: [] for i in range(max(labels) + 1)}
 
     # Organize points into clusters
@@ -66,34 +191,61 @@ def refine_clusters(labels, places, place_types):
         clusters[label].append(place)
 
     refined_clusters = []
-    for combo in combinations(clusters.keys(), len(place_types)):
-        combined_cluster = []
-        type_counts = {place_type: 0 for place_type in place_types}
-
-        for label in combo:
-            for point in clusters[label]:
-                if type_counts[point['name']] < 1:
-                    combined_cluster.append(point)
-                    type_counts[point['name']] += 1
-
-        if all(count >= 1 for count in type_counts.values()):
-            refined_clusters.append(combined_cluster)
+    with cluster_span('enumeration'):
+        for n, combo in enumerate(combinations(clusters.keys(), len(place_types))):
+            if deadline is not None and n % 1024 == 0 and time.perf_counter() > deadline:
+                break
+            combined_cluster = []
+            type_counts = {place_type: 0 for place_type in place_types}
+
+            for label in combo:
+                for point in clusters[label]:
+                    if type_counts[point['name']] < 1:
+                        combined_cluster.append(point)
+                        type_counts[point['name']] += 1
+
+            if all(count >= 1 for count in type_counts.values()):
+                refined_clusters.append(combined_cluster)
 
     return refined_clusters
 
-# Calculate the within-cluster sum of squares (WCSS), center, radius
-def calculate_wcss_center_radius(cluster_points):
-    coords = np.array([[p['lat'], p['lng']] for p in cluster_points])
-    centroid = np.mean(coords, axis=0)
-    wcss = np.sum((coords - centroid) ** 2)
-
-    # Calculate the radius of the circle that encompasses the points
-    max_distance = max(
-        haversine_distance((centroid[0], centroid[1]), (p['lat'], p['lng']))
-        for p in cluster_points
+# Calculate the within-cluster sum of squares (WCSS), center and radius (haversine
+# meters to the farthest member) of every candidate. Candidates are packed as padded
+# index rows over one shared coordinate matrix so every candidate is scored at once
+def calculate_wcss_center_radius_batch(clusters):
+    if not clusters:
+        return np.empty(0), np.empty((0, 2)), np.empty(0)
+
+    point_index = {}
+    coords = []
+    width = max(len(cluster) for cluster in clusters)
+    indices = np.zeros((len(clusters), width), dtype=int)
+    mask = np.zeros((len(clusters), width), dtype=bool)
+
+    for row, cluster in enumerate(clusters):
+        for col, p in enumerate(cluster):
+            key = (p['lat'], p['lng'])
+            if key not in point_index:
+                point_index[key] = len(coords)
+                coords.append(key)
+            indices[row, col] = point_index[key]
+            mask[row, col] = True
+
+    points = np.array(coords, dtype=float)[indices]
+    weights = mask[:, :, None]
+    counts = mask.sum(axis=1)
+
+    centroids = np.sum(points * weights, axis=1) / counts[:, None]
+    deviations = (points - centroids[:, None, :]) * weights
+    wcss = np.sum((deviations ** 2).reshape(len(clusters), -1), axis=1)
+
+    distances = haversine_distance(
+        (centroids[:, None, 0], centroids[:, None, 1]),
+        (points[:, :, 0], points[:, :, 1])
     )
+    radii = np.max(np.where(mask, distances, -np.inf), axis=1)
 
-    return wcss, {'lat': centroid[0], 'lng': centroid[1]}, max_distance
+    return wcss, centroids, radii
 
 # Dynamically determine the maximum number of clusters
 def dynamic_max_clusters(total_points, place_types):
@@ -105,48 +257,275 @@ def dynamic_max_clusters(total_points, place_types):
     
     return max_clusters
 
-# Iteratively refine clusters to minimize WCSS
-def iterative_refinement(labels, places, place_types, max_iters=100):
-    best_clusters = refine_clusters(labels, places, place_types)
-    best_wcss = sum(calculate_wcss_center_radius(cluster)[0] for cluster in best_clusters)
+# Local search budget for iterative_refinement
+REFINEMENT_MAX_ITERS = 100
+REFINEMENT_TIME_BUDGET = 0.25  # seconds
+REFINEMENT_NEIGHBOURS = 8
+
+# Iteratively refine clusters to minimize WCSS. time_budget covers both the
+# label combination enumeration and the local search.
+def iterative_refinement(labels, places, place_types, max_iters=REFINEMENT_MAX_ITERS,
+                         time_budget=REFINEMENT_TIME_BUDGET, n_neighbours=REFINEMENT_NEIGHBOURS, planar=None):
+    deadline = time.perf_counter() + time_budget
+    candidates = refine_clusters(labels, places, place_types, deadline)
+    remaining = max(0.0, deadline - time.perf_counter())
+    with cluster_span('local_search'):
+        return local_search_refinement(candidates, places, max_iters, remaining, n_neighbours, planar)
+
+# Improve each candidate by swapping a member for one of its nearest same-type
+# places whenever that lowers the candidate's WCSS. Neighbour lists come from a
+# per-type KDTree built once (on planar coords when given), and every swap is scored in O(1) from running
+# coordinate sums (WCSS = sum |x|^2 - |sum x|^2 / m) instead of recomputing it,
+# all of a candidate's swaps at once.
+# Most enumerated candidates descend into the same few clusters, so each member
+# set reached is remembered with the cluster its descent ended in: a candidate
+# that reaches a known set stops there, and each resulting cluster is returned once.
+# Stops per candidate after max_iters swaps, and overall once time_budget expires.
+def local_search_refinement(clusters, places, max_iters=REFINEMENT_MAX_ITERS,
+                            time_budget=REFINEMENT_TIME_BUDGET, n_neighbours=REFINEMENT_NEIGHBOURS, planar=None):
+    if not clusters:
+        return clusters
+
+    deadline = time.perf_counter() + time_budget
+    coords = np.array([[p['lat'], p['lng']] for p in places], dtype=float)
+    coords -= coords.mean(axis=0)  # Center to keep the sum-of-squares form well conditioned
+    squared_norms = np.sum(coords ** 2, axis=1)
+    neighbour_coords = coords if planar is None else np.asarray(planar, dtype=float)
+    place_index = {id(place): i for i, place in enumerate(places)}
+
+    type_indices = {}
+    for i, place in enumerate(places):
+        type_indices.setdefault(place['name'], []).append(i)
+
+    # Row i holds the nearest same-type places of place i, padded with i itself
+    # (swapping a member for itself never lowers WCSS)
+    width = max(1, min(n_neighbours, max(len(indices) for indices in type_indices.values()) - 1))
+    neighbours = np.repeat(np.arange(len(places))[:, None], width, axis=1)
+    for indices in type_indices.values():
+        indices = np.array(indices)
+        k = min(n_neighbours + 1, len(indices))
+        nearest = KDTree(neighbour_coords[indices]).query(neighbour_coords[indices], k=k, return_distance=False)
+        neighbours[indices, :k - 1] = indices[nearest[:, 1:]]
+
+    outcomes = {}  # Sorted member indices -> those of the cluster its descent ended in
+    refined_clusters = []
+    for n, cluster in enumerate(clusters):
+        if time.perf_counter() > deadline:
+            refined_clusters.extend(clusters[n:])  # Out of time; score_clusters drops duplicates
+            break
+        members = np.array([place_index[id(p)] for p in cluster])
+        state = tuple(sorted(members.tolist()))
+        if state in outcomes:
+            continue
+
+        m = len(members)
+        coord_sum = coords[members].sum(axis=0)
+        square_sum = squared_norms[members].sum()
+        wcss = square_sum - coord_sum @ coord_sum / m
+
+        path = [state]
+        final = None
+        for _ in range(max_iters):
+            options = neighbours[members]
+            new_sums = coord_sum - coords[members][:, None, :] + coords[options]
+            new_squares = square_sum - squared_norms[members][:, None] + squared_norms[options]
+            new_wcss = new_squares - np.sum(new_sums ** 2, axis=2) / m
+            best_options = np.argmin(new_wcss, axis=1)
+            best_wcss = new_wcss[np.arange(m), best_options]
+            replacements = options[np.arange(m), best_options]
+            best_wcss[np.isin(replacements, members) | (best_wcss >= wcss)] = np.inf
+
+            position = np.argmin(best_wcss)
+            if best_wcss[position] == np.inf:
+                break  # Converged
+
+            replacement = replacements[position]
+            coord_sum += coords[replacement] - coords[members[position]]
+            square_sum += squared_norms[replacement] - squared_norms[members[position]]
+            members[position] = replacement
+            wcss = best_wcss[position]
+
+            state = tuple(sorted(members.tolist()))
+            if state in outcomes:
+                final = outcomes[state]
+                break
+            path.append(state)
+
+            if time.perf_counter() > deadline:
+                break
+
+        if final is None:
+            # A new cluster; descents that reached a known set added theirs already
+            final = state
+            refined_clusters.append([places[i] for i in members])
+        for visited in path:
+            outcomes[visited] = final
 
-    for _ in range(max_iters):
-        new_clusters = refine_clusters(labels, places, place_types)
-        new_wcss = sum(calculate_wcss_center_radius(cluster)[0] for cluster in new_clusters)
+    return refined_clusters
 
-        if new_wcss < best_wcss:
-            best_wcss = new_wcss
-            best_clusters = new_clusters
-        else:
-            break  # Converged
+# Exact solver limits: inputs above BRANCH_AND_BOUND_MAX_PLACES skip it, and at
+# most BRANCH_AND_BOUND_MAX_CANDIDATES of the lowest-WCSS candidates are kept
+BRANCH_AND_BOUND_MAX_PLACES = 100
+BRANCH_AND_BOUND_MAX_CANDIDATES = 500
+
+# select_clusters favours the strategy with the most valid candidates, which
+# the exact solver always has. So it only contributes every candidate on the
+# small inputs the original brute-force solver handled; above them it
+# contributes the pairwise disjoint ones, greedily by lowest WCSS, which caps
+# its output at the count of the rarest place type.
+ALL_CANDIDATES_MAX_PLACES = 10
+ALL_CANDIDATES_MAX_TYPES = 3
+
+def keeps_all_candidates(place_latlngs, place_types):
+    return len(place_latlngs) <= ALL_CANDIDATES_MAX_PLACES and len(place_types) <= ALL_CANDIDATES_MAX_TYPES
+
+# Exact search over one place per type (the Cartesian product of the per-type
+# buckets, rarest type first). Adding a point never lowers WCSS, so a branch is
+# pruned once its partial WCSS reaches the cutoff: wcss_bound (the loosest
+# preference threshold) until max_candidates are held, then the worst kept
+# candidate. The overall best candidate is always kept, even above wcss_bound,
+# for the lowest-preference fallback in select_clusters. With disjoint, only
+# candidates sharing no place with a lower-WCSS kept one are returned.
+def branch_and_bound_clustering(coords, places, place_types, wcss_bound=None,
+                                max_candidates=BRANCH_AND_BOUND_MAX_CANDIDATES, disjoint=False):
+    if wcss_bound is None:
+        wcss_bound = MAX_WCSS_THRESHOLD
+
+    type_indices = {place_type: [] for place_type in place_types}
+    for i, place in enumerate(places):
+        type_indices[place['name']].append(i)
+    buckets = sorted((np.array(indices) for indices in type_indices.values()), key=len)
+    if not buckets or any(len(bucket) == 0 for bucket in buckets):
+        return []
 
-    return best_clusters
+    points = np.asarray(coords, dtype=float)
+    points = points - points.mean(axis=0)  # Center to keep the sum-of-squares form well conditioned
+    squared_norms = np.sum(points ** 2, axis=1)
+
+    kept = []  # Max-heap on wcss via negated keys: (-wcss, tie_breaker, members)
+    best_wcss = float('inf')
+    counter = count()
+
+    def cutoff():
+        if len(kept) >= max_candidates:
+            return -kept[0][0]
+        return max(wcss_bound, best_wcss)
+
+    def search(depth, members, coord_sum, square_sum):
+        nonlocal best_wcss
+        bucket = buckets[depth]
+        m = depth + 1
+        new_sums = coord_sum + points[bucket]
+        new_squares = square_sum + squared_norms[bucket]
+        new_wcss = new_squares - np.sum(new_sums ** 2, axis=1) / m
+
+        for option in np.argsort(new_wcss):
+            wcss = new_wcss[option]
+            if wcss >= cutoff():
+                break  # Options are sorted, so every later one is pruned too
+            index = bucket[option]
+            if depth + 1 < len(buckets):
+                search(depth + 1, members + [index], new_sums[option], new_squares[option])
+                continue
+
+            best_wcss = min(best_wcss, wcss)
+            heapq.heappush(kept, (-wcss, next(counter), members + [index]))
+            if len(kept) > max_candidates:
+                heapq.heappop(kept)
+
+    with cluster_span('enumeration'):
+        search(0, [], np.zeros(2), 0.0)
+
+    kept.sort(reverse=True)
+    candidates = [members for _, _, members in kept]
+    if disjoint:
+        used = set()
+        disjoint_candidates = []
+        for members in candidates:
+            if used.isdisjoint(members):
+                used.update(members)
+                disjoint_candidates.append(members)
+        candidates = disjoint_candidates
+    return [[places[i] for i in members] for members in candidates]
+
+# Anchor a candidate on every place of the rarest type and attach the nearest
+# place of each other type, found through a per-type KDTree on planar coords
+# (see project_to_local_frame). Building the trees is O(n log n) and each
+# anchor costs one O(log n) query per type.
+def nearest_neighbour_clustering(coords, places, place_types, type_trees=None):
+    if type_trees is None:
+        type_trees = index_place_types(places, coords, build_trees=False)
+
+    if any(place_type not in type_trees for place_type in place_types):
+        return []
 
-# Brute-force method for very small datasets
-def brute_force_clustering(coords, places, place_types):
-    clusters = []
-    for combo in combinations(range(len(coords)), len(place_types)):
-        cluster = [places[i] for i in combo]
-        types = {place['name'] for place in cluster}
-        if len(types) == len(place_types):
-            clusters.append(cluster)
-    return clusters
+    coords = np.asarray(coords, dtype=float)
+    anchor_type = min(place_types, key=lambda place_type: len(type_trees[place_type][0]))
+    anchors = type_trees[anchor_type][0]
+
+    members = [anchors]
+    for place_type in place_types:
+        if place_type == anchor_type:
+            continue
+        indices, tree = type_trees[place_type]
+        if tree is None:
+            tree = KDTree(coords[indices])
+        nearest = tree.query(coords[anchors], k=1, return_distance=False)[:, 0]
+        members.append(indices[nearest])
+
+    return [[places[i] for i in row] for row in np.column_stack(members)]
+
+# {place_type: (indices into places, KDTree over those places' coords)}. Without
+# build_trees the trees are None and left to the caller to build as needed.
+def index_place_types(places, coords, build_trees=True):
+    type_indices = {}
+    for i, place in enumerate(places):
+        type_indices.setdefault(place['name'], []).append(i)
+
+    coords = np.asarray(coords, dtype=float)
+    return {place_type: (np.array(indices), KDTree(coords[indices]) if build_trees else None)
+            for place_type, indices in type_indices.items()}
 
 def calculate_dynamic_min_samples(coords, factor=0.05):
     min_samples = max(1, int(len(coords) * factor))
     return min_samples
 
-def calculate_dynamic_eps(coords, percentile=10):
-    distances = pairwise_distances(coords)
-    sorted_distances = np.sort(distances.flatten())
-    eps = sorted_distances[int(len(sorted_distances) * (percentile / 100))]
+# Number of pairwise distances examined when estimating eps. Inputs with at most
+# this many ordered pairs (n * n) are handled exactly; larger inputs are sampled.
+EPS_SAMPLE_SIZE = 250000
+
+# eps is the given percentile of all n * n pairwise distances (diagonal included).
+# Small inputs select that exact order statistic with np.partition over chunked
+# distance rows. Larger inputs draw EPS_SAMPLE_SIZE ordered pairs uniformly with
+# replacement; by the DKW inequality the sample percentile then lies between the
+# true (percentile - 0.5) and (percentile + 0.5) percentiles with probability
+# above 1 - 2 * exp(-2 * EPS_SAMPLE_SIZE * 0.005 ** 2) (about 1 - 1e-5).
+# Memory stays O(EPS_SAMPLE_SIZE) either way.
+def calculate_dynamic_eps(coords, percentile=10, sample_size=EPS_SAMPLE_SIZE, seed=0):
+    coords = np.asarray(coords, dtype=float)
+    total_pairs = len(coords) ** 2
+
+    if total_pairs <= sample_size:
+        distances = np.concatenate([
+            chunk.ravel() for chunk in pairwise_distances_chunked(coords)
+        ])
+    else:
+        rng = np.random.default_rng(seed)
+        first = rng.integers(0, len(coords), sample_size)
+        second = rng.integers(0, len(coords), sample_size)
+        distances = np.linalg.norm(coords[first] - coords[second], axis=1)
+
+    rank = int(len(distances) * (percentile / 100))
+    eps = np.partition(distances, rank)[rank]
     return eps
 
 # Hierarchical clustering or DBSCAN
 def dbscan_clustering(coords, places, place_types):
-    eps = calculate_dynamic_eps(coords)
+    with cluster_span('eps'):
+        eps = calculate_dynamic_eps(coords)
     min_samples = calculate_dynamic_min_samples(coords)
-    db = DBSCAN(eps=eps, min_samples=min_samples).fit(coords)
+    with cluster_span('dbscan_fit'):
+        db = DBSCAN(eps=eps, min_samples=min_samples).fit(coords)
     # print('DBSCAN RESULTS: ', db, '\n\n')
     labels = db.labels_
     # print('DBSCAN LABELS: ', labels, '\n\n')
@@ -158,32 +537,33 @@ def dbscan_clustering(coords, places, place_types):
         clusters[label].append(info)
     
     refined_clusters = []
-    for combo in combinations(clusters.keys(), len(place_types)):
-        combined_cluster = []
-        type_counts = {place_type: 0 for place_type in place_types}
-        
-        for label in combo:
-            for point in clusters[label]:
-                if type_counts[point['name']] < 1:
-                    combined_cluster.append(point)
-                    type_counts[point['name']] += 1
-        
-        if all(count >= 1 for count in type_counts.values()):
-            refined_clusters.append(combined_cluster)
+    with cluster_span('enumeration'):
+        for combo in combinations(clusters.keys(), len(place_types)):
+            combined_cluster = []
+            type_counts = {place_type: 0 for place_type in place_types}
+
+            for label in combo:
+                for point in clusters[label]:
+                    if type_counts[point['name']] < 1:
+                        combined_cluster.append(point)
+                        type_counts[point['name']] += 1
+
+            if all(count >= 1 for count in type_counts.values()):
+                refined_clusters.append(combined_cluster)
     
     return refined_clusters
 
+# WCSS thresholds for the lowest (0) and highest (1) user preference
+MIN_WCSS_THRESHOLD = .00002
+MAX_WCSS_THRESHOLD = .002
+
 # Function to evaluate clusters based on wcss
 def evaluate_clusters(clusters, preference):
-    valid_clusters = []
-    failed_clusters = []
-    total_wcss = 0
-    count_valid = 0
-    min_value = .00002
-    max_value = .002
-    wcss_threshold = min_value + (max_value - min_value) * preference
-    print('wcss_threshold',wcss_threshold)
+    return select_clusters(score_clusters(clusters), preference)
 
+# Remove duplicate clusters and compute wcss, center and radius for each.
+# The result does not depend on the user's preference.
+def score_clusters(clusters):
     # Helper function to create a unique identifier for a cluster based on its points
     def create_cluster_identifier(cluster):
         return frozenset((p['lat'], p['lng']) for p in cluster)
@@ -193,33 +573,40 @@ def evaluate_clusters(clusters, preference):
         create_cluster_identifier(cluster): cluster for cluster in clusters
     }.values())
 
-    for i, cluster in enumerate(unique_clusters):
-        wcss, center, radius = calculate_wcss_center_radius(cluster)
-        if wcss < wcss_threshold:
-            valid_clusters.append({
-                'cluster': i,
-                'places': cluster,
-                'wcss': wcss,
-                'center': center,
-                'radius': radius
-            })
-            total_wcss += wcss
+    wcss_values, centroids, radii = calculate_wcss_center_radius_batch(unique_clusters)
+
+    return [{
+        'cluster': i,
+        'places': cluster,
+        'wcss': wcss_values[i],
+        'center': {'lat': centroids[i, 0], 'lng': centroids[i, 1]},
+        'radius': radii[i]
+    } for i, cluster in enumerate(unique_clusters)]
+
+# Filter scored clusters by the preference's wcss threshold and rank them
+def select_clusters(scored_clusters, preference):
+    valid_clusters = []
+    failed_clusters = []
+    total_wcss = 0
+    count_valid = 0
+    min_value = MIN_WCSS_THRESHOLD
+    max_value = MAX_WCSS_THRESHOLD
+    wcss_threshold = min_value + (max_value - min_value) * preference
+
+    for scored in scored_clusters:
+        if scored['wcss'] < wcss_threshold:
+            valid_clusters.append(dict(scored))
+            total_wcss += scored['wcss']
             count_valid += 1
         else:
-            failed_clusters.append({
-                'cluster': i,
-                'places': cluster,
-                'wcss': wcss,
-                'center': center,
-                'radius': radius
-            })
+            failed_clusters.append(scored)
 
     valid_clusters.sort(key=lambda x: x['wcss']) #sort in ascending order by wcss
 
     # If user set lowest quality setting and still didn't find any valid clusters return the next best...
     if wcss_threshold == min_value and len(valid_clusters) <= 0 and len(failed_clusters) > 0:
         failed_clusters.sort(key=lambda x: x['wcss'])
-        valid_clusters.append(failed_clusters[0])
+        valid_clusters.append(dict(failed_clusters[0]))
         total_wcss = valid_clusters[0]['wcss']
         count_valid = 1
 
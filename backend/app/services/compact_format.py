@@ -0,0 +1,65 @@
+from flask import Response
+import json
+import msgpack
+
+# Opt-in compact encodings for place and cluster payloads, negotiated through
+# the Accept header. Places go into one deduplicated columnar table (names
+# interned, lat/lng arrays) and clusters refer to its rows by index, so a place
+# shared by many clusters is serialized once.
+COMPACT_JSON_MIMETYPE = 'application/vnd.pcz.compact+json'
+MSGPACK_MIMETYPE = 'application/x-msgpack'
+COMPACT_MIMETYPES = (COMPACT_JSON_MIMETYPE, MSGPACK_MIMETYPE, 'application/msgpack')
+
+# The compact mimetype the client prefers over plain JSON, or None
+def negotiate_compact(request):
+    best = request.accept_mimetypes.best_match(('application/json',) + COMPACT_MIMETYPES)
+    return best if best in COMPACT_MIMETYPES else None
+
+class PlaceTable:
+    def __init__(self):
+        self.rows = {}
+        self.name_ids = {}
+        self.table = {'name': [], 'lat': [], 'lng': []}
+
+    # Row index of the place, adding it on first sight
+    def add(self, place):
+        key = (place['name'], place['lat'], place['lng'])
+        row = self.rows.get(key)
+        if row is None:
+            row = self.rows[key] = len(self.rows)
+            self.table['name'].append(self.name_ids.setdefault(place['name'], len(self.name_ids)))
+            self.table['lat'].append(float(place['lat']))
+            self.table['lng'].append(float(place['lng']))
+        return row
+
+    def to_dict(self):
+        return {'names': list(self.name_ids), **self.table}
+
+def compact_places(places):
+    table = PlaceTable()
+    for place in places:
+        table.add(place)
+    return {'places': table.to_dict()}
+
+def compact_clusters(clusters, places=()):
+    table = PlaceTable()
+    for place in places:
+        table.add(place)
+    columns = {'cluster': [], 'places': [], 'wcss': [], 'center_lat': [], 'center_lng': [], 'radius': []}
+    for cluster in clusters:
+        columns['cluster'].append(int(cluster['cluster']))
+        columns['places'].append([table.add(place) for place in cluster['places']])
+        columns['wcss'].append(float(cluster['wcss']))
+        columns['center_lat'].append(float(cluster['center']['lat']))
+        columns['center_lng'].append(float(cluster['center']['lng']))
+        columns['radius'].append(float(cluster['radius']))
+    return {'places': table.to_dict(), 'clusters': columns}
+
+def compact_response(payload, mimetype):
+    if mimetype == COMPACT_JSON_MIMETYPE:
+        body = json.dumps(payload, separators=(',', ':'))
+    else:
+        body = msgpack.packb(payload)
+    response = Response(body, mimetype=mimetype)
+    response.vary.add('Accept')
+    return response
@@ -0,0 +1,40 @@
+import numpy as np
+from app.services.search_service import iter_search
+from app.services.cluster_service import perform_clustering, index_place_types
+from app.utils import project_to_local_frame
+
+# Searches every place name and clusters the combined results in one pass.
+# Each name's results are projected about the search center and given per-type
+# KDTrees as soon as they arrive, while the remaining names are still fetching;
+# clustering then reuses that projection and those trees.
+# Returns (places, clusters, report); report is None when nothing was found.
+def search_and_cluster(place_names, search_center, search_radius, max_page_results, user_preference):
+    origin = (search_center['lat'], search_center['lng'])
+
+    batches = {}
+    for index, _, results in iter_search(place_names, search_center, search_radius, max_page_results):
+        latlngs = np.array([[place['lat'], place['lng']] for place in results], dtype=float).reshape(-1, 2)
+        planar = project_to_local_frame(latlngs, origin)
+        batches[index] = (results, latlngs, planar, index_place_types(results, planar))
+
+    # Stitch the batches together in the order the place names were given
+    places = []
+    type_trees = {}
+    shared_type = False
+    for index in sorted(batches):
+        results, _, _, batch_trees = batches[index]
+        for place_type, (indices, tree) in batch_trees.items():
+            shared_type = shared_type or place_type in type_trees
+            type_trees[place_type] = (indices + len(places), tree)
+        places.extend(results)
+
+    if not places:
+        return places, [], None
+
+    place_names = [place['name'] for place in places]
+    place_latlngs = np.vstack([batches[index][1] for index in sorted(batches)])
+    planar = np.vstack([batches[index][2] for index in sorted(batches)])
+    # Two names that refine to the same type have split trees; let the strategy rebuild them
+    clusters, report = perform_clustering(places, place_names, place_latlngs, user_preference,
+                                          planar=planar, type_trees=None if shared_type else type_trees)
+    return places, clusters, report
@@ -0,0 +1,203 @@
+from cachetools import TTLCache
+from contextlib import contextmanager
+from flask import current_app
+from uuid import uuid4
+import json, math, threading, time
+import redis
+
+# Two-level cache of raw (unrefined) Places results per (query, bounding box).
+# Level one is an in-process LRU with a TTL; level two is Redis at REDIS_URL,
+# shared by every worker. A search whose box lies inside a cached complete
+# search for the same query is answered by filtering the cached results.
+PLACES_CACHE_SIZE = 512
+PLACES_CACHE_TTL = 900  # seconds
+BBOX_DECIMALS = 4  # Quantize box corners to ~11 m when building keys
+FETCH_LOCK_TTL = 15  # seconds; upper bound on one worker's fetch for a key
+FETCH_LOCK_POLL = 0.1  # seconds between checks while another worker fetches
+
+# Deletes the lock only if this worker still owns it
+RELEASE_LOCK_SCRIPT = """
+if redis.call('get', KEYS[1]) == ARGV[1] then
+    return redis.call('del', KEYS[1])
+end
+return 0
+"""
+
+local_cache = TTLCache(maxsize=PLACES_CACHE_SIZE, ttl=PLACES_CACHE_TTL)
+local_cache_lock = threading.Lock()
+redis_clients = {}
+
+def normalize_query(query):
+    return ' '.join(query.lower().split())
+
+# Rounds the box outwards so the quantized box always covers the requested one
+def quantize_bbox(northeast, southwest):
+    scale = 10 ** BBOX_DECIMALS
+    return (
+        (math.ceil(northeast[0] * scale) / scale, math.ceil(northeast[1] * scale) / scale),
+        (math.floor(southwest[0] * scale) / scale, math.floor(southwest[1] * scale) / scale),
+    )
+
+def cache_key(query, northeast, southwest):
+    (ne_lat, ne_lng), (sw_lat, sw_lng) = quantize_bbox(northeast, southwest)
+    return f'places:{normalize_query(query)}:{sw_lat},{sw_lng},{ne_lat},{ne_lng}'
+
+# Hash of the complete entries cached for a query: entry key -> JSON
+# [sw_lat, sw_lng, ne_lat, ne_lng, expires_at], so a containing entry can be
+# found from the index alone and only that entry fetched
+def query_index_key(query):
+    return f'places:boxes:{normalize_query(query)}'
+
+def contains(outer, northeast, southwest):
+    return (outer['southwest'][0] <= southwest[0] and outer['southwest'][1] <= southwest[1]
+            and outer['northeast'][0] >= northeast[0] and outer['northeast'][1] >= northeast[1])
+
+# Copies, since refine_results renames the places it is given
+def filter_to_bbox(results, northeast, southwest):
+    return [dict(place) for place in results
+            if southwest[0] <= place['lat'] <= northeast[0] and southwest[1] <= place['lng'] <= northeast[1]]
+
+# Redis client for the configured REDIS_URL, or None when level two is disabled
+def get_redis():
+    url = current_app.config.get('REDIS_URL')
+    if not url:
+        return None
+    if url not in redis_clients:
+        redis_clients[url] = redis.Redis.from_url(url, socket_timeout=0.5)
+    return redis_clients[url]
+
+# Cached results for the query within the box, or None on a miss
+def get_cached_places(query, northeast, southwest):
+    key = cache_key(query, northeast, southwest)
+    query = normalize_query(query)
+
+    with local_cache_lock:
+        entry = local_cache.get(key)
+        if entry is None:
+            entry = next((candidate for candidate in local_cache.values()
+                          if candidate['query'] == query and candidate['complete']
+                          and contains(candidate, northeast, southwest)), None)
+    if entry is None:
+        entry = get_remote_entry(key, query, northeast, southwest)
+        if entry is not None:
+            with local_cache_lock:
+                local_cache[cache_key(query, entry['northeast'], entry['southwest'])] = entry
+
+    if entry is None:
+        return None
+    return filter_to_bbox(entry['results'], northeast, southwest)
+
+# Exact or containing entry from Redis, or None. The exact key and the query's
+# index come back in one round trip; a containing entry, smallest box first, in
+# one more.
+def get_remote_entry(key, query, northeast, southwest):
+    client = get_redis()
+    if client is None:
+        return None
+    index_key = query_index_key(query)
+    try:
+        pipeline = client.pipeline(transaction=False)
+        pipeline.get(key)
+        pipeline.hgetall(index_key)
+        raw, index = pipeline.execute()
+        if raw is not None:
+            return json.loads(raw)
+
+        now = time.time()
+        expired = []
+        candidates = []
+        for other_key, box in index.items():
+            sw_lat, sw_lng, ne_lat, ne_lng, expires_at = json.loads(box)
+            if expires_at <= now:
+                expired.append(other_key)
+            elif contains({'northeast': (ne_lat, ne_lng), 'southwest': (sw_lat, sw_lng)}, northeast, southwest):
+                candidates.append(((ne_lat - sw_lat) * (ne_lng - sw_lng), other_key))
+        if expired:
+            client.hdel(index_key, *expired)
+
+        for _, other_key in sorted(candidates):
+            raw = client.get(other_key)
+            if raw is not None:
+                candidate = json.loads(raw)
+                if candidate['complete']:
+                    return candidate
+            client.hdel(index_key, other_key)  # Evicted, or replaced by an incomplete fetch
+        return None
+    except redis.exceptions.RedisError as redis_err:
+        print(f'Places cache unavailable: {redis_err}')
+        return None
+
+# Stores results for the query and box; complete marks results that are not
+# truncated by saturation, which makes them reusable for contained boxes
+def set_cached_places(query, northeast, southwest, results, complete):
+    key = cache_key(query, northeast, southwest)
+    entry = {
+        'query': normalize_query(query),
+        'northeast': list(northeast),
+        'southwest': list(southwest),
+        'results': [dict(place) for place in results],
+        'complete': complete,
+    }
+    with local_cache_lock:
+        local_cache[key] = entry
+
+    client = get_redis()
+    if client is None:
+        return
+    try:
+        pipeline = client.pipeline()
+        pipeline.setex(key, PLACES_CACHE_TTL, json.dumps(entry))
+        if complete:
+            box = [southwest[0], southwest[1], northeast[0], northeast[1], time.time() + PLACES_CACHE_TTL]
+            pipeline.hset(query_index_key(query), key, json.dumps(box))
+            pipeline.expire(query_index_key(query), PLACES_CACHE_TTL)
+        else:
+            pipeline.hdel(query_index_key(query), key)
+        pipeline.execute()
+    except redis.exceptions.RedisError as redis_err:
+        print(f'Places cache unavailable: {redis_err}')
+
+# Cross-worker half of single-flight fetching. Yields True when this worker
+# should fetch: it took the Redis lock for the key, or Redis single-flight is
+# disabled or unavailable. Yields False while another worker holds the lock.
+@contextmanager
+def remote_fetch_lock(key):
+    client = get_redis() if current_app.config.get('PLACES_REDIS_SINGLE_FLIGHT', True) else None
+    if client is None:
+        yield True
+        return
+
+    lock_key = f'lock:{key}'
+    token = uuid4().hex
+    try:
+        acquired = bool(client.set(lock_key, token, nx=True, px=FETCH_LOCK_TTL * 1000))
+    except redis.exceptions.RedisError as redis_err:
+        print(f'Places cache unavailable: {redis_err}')
+        yield True
+        return
+
+    try:
+        yield acquired
+    finally:
+        if acquired:
+            try:
+                client.eval(RELEASE_LOCK_SCRIPT, 1, lock_key, token)
+            except redis.exceptions.RedisError as redis_err:
+                print(f'Places cache unavailable: {redis_err}')
+
+# Waits for another worker's fetch of the key to land in the cache. Returns the
+# cached results, or None if the lock went away (or timed out) without them.
+def wait_for_remote_fetch(key, query, northeast, southwest, timeout=FETCH_LOCK_TTL):
+    client = get_redis()
+    deadline = time.monotonic() + timeout
+    try:
+        while time.monotonic() < deadline:
+            results = get_cached_places(query, northeast, southwest)
+            if results is not None:
+                return results
+            if not client.exists(f'lock:{key}'):
+                return get_cached_places(query, northeast, southwest)  # Released just after the check above
+            time.sleep(FETCH_LOCK_POLL)
+    except redis.exceptions.RedisError as redis_err:
+        print(f'Places cache unavailable: {redis_err}')
+    return None
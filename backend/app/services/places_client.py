@@ -0,0 +1,44 @@
+import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+
+PLACES_SEARCH_URL = 'https://places.googleapis.com/v1/places:searchText'
+PLACES_FIELD_MASK = 'places.displayName,places.location'
+
+# Defaults, overridable through the app config (see Config)
+PLACES_TIMEOUT = 10.0  # seconds, per call
+PLACES_MAX_CONCURRENCY = 5
+PLACES_MAX_RETRIES = 3
+PLACES_BACKOFF_FACTOR = 0.3  # sleeps 0.3s, 0.6s, 1.2s between retries
+PLACES_POOL_SIZE = 20
+
+# Keep-alive session with a shared connection pool; retries connection errors
+# and 429/5xx responses with exponential backoff
+def create_places_session(pool_size=PLACES_POOL_SIZE, max_retries=PLACES_MAX_RETRIES,
+                          backoff_factor=PLACES_BACKOFF_FACTOR):
+    retry = Retry(
+        total=max_retries,
+        backoff_factor=backoff_factor,
+        status_forcelist=(429, 500, 502, 503, 504),
+        allowed_methods=frozenset(['POST']),
+        raise_on_status=False
+    )
+    adapter = HTTPAdapter(pool_connections=1, pool_maxsize=pool_size, max_retries=retry)
+    session = requests.Session()
+    session.mount('https://', adapter)
+    session.mount('http://', adapter)
+    return session
+
+places_session = create_places_session()
+
+# POSTs a Places API (New) Text Search request and returns the decoded JSON body.
+# Raises requests exceptions on HTTP errors, timeouts and connection failures.
+def search_text(payload, api_key, url=PLACES_SEARCH_URL, timeout=PLACES_TIMEOUT,
+                field_mask=PLACES_FIELD_MASK):
+    headers = {'Content-Type': 'application/json',
+               'X-Goog-Api-Key': api_key,
+               'X-Goog-FieldMask': field_mask}
+
+    response = places_session.post(url, json=payload, headers=headers, timeout=timeout)
+    response.raise_for_status()  # Raise an error for bad status codes
+    return response.json()
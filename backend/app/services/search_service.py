@@ -1,37 +1,295 @@
-import json, requests
-from app.utils import calculate_bounding_box, haversine_distance
-from flask import current_app
+import requests
+import numpy as np
+from app.utils import calculate_bounding_box, haversine_to_many, grid_steps
+from app.services.places_client import search_text, PLACES_SEARCH_URL, PLACES_TIMEOUT, PLACES_MAX_CONCURRENCY, PLACES_FIELD_MASK
+from app.services.places_cache import (
+    get_cached_places, set_cached_places, cache_key, remote_fetch_lock, wait_for_remote_fetch
+)
+from app.services.single_flight import SingleFlight
+from app.metrics import (
+    places_calls, places_call_latency, places_call_errors, places_page_results, places_fetches,
+    places_budget_rejections
+)
+from flask import current_app, g
+from contextlib import contextmanager
+from concurrent.futures import ThreadPoolExecutor, as_completed, wait, FIRST_COMPLETED
 from typing import List, Dict
-import re
+import re, threading, time
+from collections import Counter, defaultdict
 from difflib import SequenceMatcher
+from functools import lru_cache
 
+# Fetches every place name concurrently; results keep the order of place_names
 def perform_search(place_names, search_center, search_radius, max_page_results):
+    results_by_index = {}
+    for index, _, results in iter_search(place_names, search_center, search_radius, max_page_results):
+        results_by_index[index] = results
+
     response_data=[]
-    for placeName in place_names:
-        results = []
-        placeName = placeName.strip()
-        placeData = get_place_data(
-            placeName, 
-            (search_center['lat'], search_center['lng']), 
-            search_radius, 
-            max_page_results
-        )
-        if placeData:
-            for place in placeData.get('places', []):
-                placeLocation = {
-                    'name': place['displayName']['text'],
-                    'lat': place['location']['latitude'],
-                    'lng': place['location']['longitude']
-                }
-                results.append(placeLocation)
-            response_data.extend(refine_results(placeName, results))
+    for index in sorted(results_by_index):
+        response_data.extend(results_by_index[index])
     
     return response_data
 
-# Returns json of places: displayName.text, location.latitude & longitude
-def get_place_data(placeName, searchCenter, searchRadius, maxPageResults):
-    northeast, southwest = calculate_bounding_box(searchCenter, searchRadius)
-    url = 'https://places.googleapis.com/v1/places:searchText'
+# Fetches every place name concurrently over the shared Places connection pool,
+# yielding (index, place_name, refined_results) for each name as soon as it is ready.
+# Every upstream call of the search, across all names and tiles, runs on one pool
+# of PLACES_MAX_CONCURRENCY threads, so at most that many calls are in flight.
+def iter_search(place_names, search_center, search_radius, max_page_results):
+    app = current_app._get_current_object()
+    max_calls = max(1, app.config.get('PLACES_MAX_CONCURRENCY', PLACES_MAX_CONCURRENCY))
+    max_workers = min(len(place_names), max_calls) or 1
+
+    user_id = g.get('user_id')
+
+    with ThreadPoolExecutor(max_workers=max_calls, thread_name_prefix='places-fetch') as fetch_executor:
+        def search_place(placeName):
+            with worker_context(app, user_id, fetch_executor):
+                return search_place_name(placeName, search_center, search_radius, max_page_results)
+
+        with ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix='places-search') as executor:
+            futures = {executor.submit(search_place, placeName): index for index, placeName in enumerate(place_names)}
+            for future in as_completed(futures):
+                index = futures[future]
+                yield index, place_names[index], future.result()
+
+# App context for a worker thread, carrying the requesting user over for accounting
+# and, for search workers, the search's pool for upstream calls
+@contextmanager
+def worker_context(app, user_id, fetch_executor=None):
+    with app.app_context():
+        g.user_id = user_id
+        g.places_executor = fetch_executor
+        yield
+
+# The current search's pool for upstream calls, or a private one of
+# PLACES_MAX_CONCURRENCY threads when called outside iter_search
+@contextmanager
+def places_executor():
+    executor = g.get('places_executor')
+    if executor is not None:
+        yield executor
+        return
+    max_calls = max(1, current_app.config.get('PLACES_MAX_CONCURRENCY', PLACES_MAX_CONCURRENCY))
+    with ThreadPoolExecutor(max_workers=max_calls, thread_name_prefix='places-fetch') as executor:
+        yield executor
+
+# Exact per-user upstream call counts per fixed window of PLACES_BUDGET_WINDOW_SECONDS
+# (kept here rather than as metric labels). When PLACES_USER_CALL_BUDGET is set,
+# a user may make at most that many calls per window: once it is spent, further
+# calls are refused as they are made, however far pagination and tiling fan out.
+# 0 disables the limit.
+budget_windows = {}  # user_id -> [window_start, calls]
+budget_lock = threading.Lock()
+
+# Checked before fanning out a search that needs at least planned_calls calls.
+# Returns 0 when it fits the user's remaining budget, else seconds until the window resets.
+def check_places_budget(user_id, planned_calls):
+    budget = current_app.config.get('PLACES_USER_CALL_BUDGET', 0)
+    if not budget or user_id is None:
+        return 0
+    window = current_app.config.get('PLACES_BUDGET_WINDOW_SECONDS', 3600)
+    now = time.monotonic()
+    with budget_lock:
+        window_start, calls = budget_windows.get(user_id, (now, 0))
+        if now - window_start >= window:
+            return 0
+        if calls + planned_calls <= budget:
+            return 0
+    places_budget_rejections.inc()
+    return max(1, int(window_start + window - now))
+
+# Counts one upstream call against the user's window. Returns False, without
+# counting it, when the user's budget for the window is already spent.
+def charge_places_budget(user_id):
+    if user_id is None:
+        return True
+    budget = current_app.config.get('PLACES_USER_CALL_BUDGET', 0)
+    window = current_app.config.get('PLACES_BUDGET_WINDOW_SECONDS', 3600)
+    now = time.monotonic()
+    with budget_lock:
+        entry = budget_windows.get(user_id)
+        if entry is None or now - entry[0] >= window:
+            budget_windows[user_id] = [now, 1]
+            return True
+        if not budget or entry[1] < budget:
+            entry[1] += 1
+            return True
+    places_budget_rejections.inc()
+    return False
+
+# The API serves at most 3 pages (60 results) per query. A rectangle whose first
+# page is full and offers another is split into quadrants straight away, up to
+# PLACES_MAX_TILE_DEPTH levels deep (4 ** depth tiles): the quadrants cover the
+# same area, so paging on through the parent would only fetch places twice.
+# A rectangle at the deepest level pages up to PLACES_MAX_PAGES and is
+# saturated when the last allowed page is full.
+PLACES_MAX_PAGES = 3
+PLACES_MAX_TILE_DEPTH = 2
+PLACES_PAGE_FIELD_MASK = PLACES_FIELD_MASK + ',nextPageToken'
+
+# Raised when a Places request fails, so partial results are never cached
+class PlacesRequestError(Exception):
+    pass
+
+# Raised instead of making a Places request once the user's call budget is spent
+class PlacesBudgetExceeded(PlacesRequestError):
+    def __init__(self, placeName, user_id):
+        super().__init__(f'Places call budget spent during the search for {placeName}; skipping its results.')
+        self.user_id = user_id
+
+# Identical in-flight (query, box) fetches within this worker share one upstream fetch
+places_flight = SingleFlight()
+
+# Fetches (or reuses cached results for) and refines a single place name
+def search_place_name(placeName, search_center, search_radius, max_page_results):
+    placeName = placeName.strip()
+    northeast, southwest = calculate_bounding_box((search_center['lat'], search_center['lng']), search_radius)
+
+    results = get_cached_places(placeName, northeast, southwest)
+    if results is None:
+        try:
+            results = fetch_places_shared(placeName, northeast, southwest, max_page_results)
+        except PlacesRequestError as error:
+            print(error)
+            return []
+        results = [dict(place) for place in results]  # Shared with other waiters; refine_results renames
+    return refine_results(placeName, results)
+
+# Single-flight fetch. A flight cut short by another user's spent budget is
+# retried, so one heavy user cannot fail the searches that shared their fetch.
+def fetch_places_shared(placeName, northeast, southwest, maxPageResults):
+    user_id = g.get('user_id')
+    while True:
+        try:
+            return places_flight.do(
+                cache_key(placeName, northeast, southwest),
+                lambda: fetch_places_once(placeName, northeast, southwest, maxPageResults)
+            )
+        except PlacesBudgetExceeded as error:
+            if error.user_id == user_id:
+                raise
+
+# Leader side of a single-flight fetch. Re-checks the cache (another flight may
+# have just filled it), then coordinates with other workers through a Redis
+# lock: the lock holder fetches and caches, everyone else waits for the cache.
+def fetch_places_once(placeName, northeast, southwest, maxPageResults):
+    results = get_cached_places(placeName, northeast, southwest)
+    if results is not None:
+        return results
+
+    key = cache_key(placeName, northeast, southwest)
+    with remote_fetch_lock(key) as acquired:
+        if not acquired:
+            results = wait_for_remote_fetch(key, placeName, northeast, southwest)
+            if results is not None:
+                return results
+
+        results, complete = fetch_places(placeName, northeast, southwest, maxPageResults)
+        set_cached_places(placeName, northeast, southwest, results, complete)
+        return results
+
+# Extracts name & location from a Places API result
+def to_place_location(place):
+    return {
+        'name': place['displayName']['text'],
+        'lat': place['location']['latitude'],
+        'lng': place['location']['longitude']
+    }
+
+# All places for a query inside a rectangle. Returns (results, complete) where
+# complete is False when the deepest tiles still saturated, i.e. places may be missing.
+# Tiles are fetched on the search's shared pool; results keep the order of a
+# depth-first walk (parent, then each quadrant in turn) whatever order tiles finish in.
+def fetch_places(placeName, northeast, southwest, maxPageResults):
+    app = current_app._get_current_object()
+    user_id = g.get('user_id')
+
+    def fetch_tile(tile, path):
+        with worker_context(app, user_id):
+            return fetch_rectangle(placeName, tile[0], tile[1], maxPageResults, len(path) < PLACES_MAX_TILE_DEPTH)
+
+    results_by_path = {}
+    complete = True
+    with places_executor() as executor:
+        pending = {executor.submit(fetch_tile, (northeast, southwest), ()): ((northeast, southwest), ())}
+        try:
+            while pending:
+                done, _ = wait(pending, return_when=FIRST_COMPLETED)
+                for future in done:
+                    tile, path = pending.pop(future)
+                    tile_results, saturated = future.result()
+                    results_by_path[path] = tile_results
+                    if not saturated:
+                        continue
+                    if len(path) >= PLACES_MAX_TILE_DEPTH:
+                        print(f'Search for {placeName} still saturated at tile depth {len(path)}; results may be incomplete.')
+                        complete = False
+                        continue
+                    for quadrant, sub_tile in enumerate(split_rectangle(*tile)):
+                        sub_path = path + (quadrant,)
+                        pending[executor.submit(fetch_tile, sub_tile, sub_path)] = (sub_tile, sub_path)
+        finally:
+            for future in pending:
+                future.cancel()
+
+    # De-duplicate across tiles
+    results = []
+    seen = set()
+    for path in sorted(results_by_path):
+        for place in results_by_path[path]:
+            key = (place['name'], place['lat'], place['lng'])
+            if key not in seen:
+                seen.add(key)
+                results.append(place)
+    return results, complete
+
+# Places for a query inside one rectangle, without tiling. Returns (results, saturated).
+# With can_split, stops after a first page that is full and offers another, leaving
+# the rest to the quadrants; otherwise pages up to PLACES_MAX_PAGES.
+def fetch_rectangle(placeName, northeast, southwest, maxPageResults, can_split):
+    results = []
+    saturated = False
+    for page_number, page in enumerate(iter_place_pages(placeName, northeast, southwest, maxPageResults)):
+        page_places = page.get('places', [])
+        results.extend(to_place_location(place) for place in page_places)
+        places_page_results.observe(len(page_places))
+        if can_split and page.get('nextPageToken') and len(page_places) >= maxPageResults:
+            saturated = True
+            break
+        # The last allowed page came back full (or still offers more): assume places were cut off
+        saturated = page_number + 1 >= PLACES_MAX_PAGES and (
+            bool(page.get('nextPageToken')) or len(page_places) >= maxPageResults
+        )
+
+    places_fetches.inc(saturated=str(saturated).lower())
+    return results, saturated
+
+# Quadrant (northeast, southwest) rectangles of a rectangle
+def split_rectangle(northeast, southwest):
+    mid_lat = (northeast[0] + southwest[0]) / 2
+    mid_lng = (northeast[1] + southwest[1]) / 2
+    return [
+        ((mid_lat, mid_lng), southwest),
+        ((mid_lat, northeast[1]), (southwest[0], mid_lng)),
+        ((northeast[0], mid_lng), (mid_lat, southwest[1])),
+        (northeast, (mid_lat, mid_lng)),
+    ]
+
+# Lazily yields result pages for one rectangle, following nextPageToken
+def iter_place_pages(placeName, northeast, southwest, maxPageResults, max_pages=PLACES_MAX_PAGES):
+    page_token = None
+    for _ in range(max_pages):
+        data = get_place_data(placeName, northeast, southwest, maxPageResults, page_token)
+        if data is None:
+            raise PlacesRequestError(f'Places request for {placeName} failed; skipping its results.')
+        yield data
+        page_token = data.get('nextPageToken')
+        if not page_token:
+            return
+
+# Returns json of places: displayName.text, location.latitude & longitude, nextPageToken
+def get_place_data(placeName, northeast, southwest, maxPageResults, pageToken=None):
     data = {
             'textQuery': placeName,
             'locationRestriction':{
@@ -48,53 +306,86 @@ def get_place_data(placeName, searchCenter, searchRadius, maxPageResults):
             },
             'pageSize': maxPageResults
             }
-    headers = {'Content-Type': 'application/json',
-                'X-Goog-Api-Key': current_app.config['GOOGLE_PLACES_API_KEY'],
-                'X-Goog-FieldMask': 'places.displayName,places.location'}
+    if pageToken:
+        data['pageToken'] = pageToken
 
-    json_data = json.dumps(data)
+    user_id = g.get('user_id')
+    if not charge_places_budget(user_id):
+        raise PlacesBudgetExceeded(placeName, user_id)
+    places_calls.inc()
 
+    start = time.perf_counter()
+    error_kind = None
     try:
-        response = requests.post(url, data=json_data, headers=headers)
-        response.raise_for_status()  # Raise an error for bad status codes
-        data = response.json()
-        return data
+        return search_text(
+            data,
+            current_app.config['GOOGLE_PLACES_API_KEY'],
+            url=current_app.config.get('GOOGLE_PLACES_API_URL') or PLACES_SEARCH_URL,
+            timeout=current_app.config.get('PLACES_TIMEOUT_SECONDS', PLACES_TIMEOUT),
+            field_mask=PLACES_PAGE_FIELD_MASK
+        )
     except requests.exceptions.HTTPError as http_err:
+        error_kind = 'http'
         print(f'HTTP error occurred: {http_err}')
     except requests.exceptions.ConnectionError as conn_err:
+        error_kind = 'timeout' if isinstance(conn_err, requests.exceptions.Timeout) else 'connection'
         print(f'Connection error occurred: {conn_err}')
     except requests.exceptions.Timeout as timeout_err:
+        error_kind = 'timeout'
         print(f'Timeout error occurred: {timeout_err}')
     except requests.exceptions.RequestException as req_err:
+        error_kind = 'other'
         print(f'An error occurred: {req_err}')
+    finally:
+        places_call_latency.observe(time.perf_counter() - start, outcome=error_kind or 'ok')
+        if error_kind:
+            places_call_errors.inc(kind=error_kind)
     return None  # Return None in case of any error
 
 
-def refine_results(place_name: str, results: List[Dict[str, str]]) -> List[Dict[str, str]]:
-    # Split place names into words using a regular expression for common delimiters, excluding quotes
-    def split_name(name: str) -> List[str]:
-        return re.split(r'[\s\-_/\\,;:.()&]+', name.lower())
+NAME_DELIMITERS = re.compile(r'[\s\-_/\\,;:.()&]+')
+MATCH_RATIO = 0.9
+
+# Split place names into words using a regular expression for common delimiters, excluding quotes
+def split_name(name: str) -> List[str]:
+    return NAME_DELIMITERS.split(name.lower())
 
+# True when SequenceMatcher(None, word, token).ratio() >= MATCH_RATIO. The ratio is
+# 2.0 * matches / total, and matches can exceed neither the shorter length nor the
+# shared character counts, so either bound below MATCH_RATIO rules the pair out
+# exactly (they are difflib's real_quick_ratio and quick_ratio). Memoized per pair.
+@lru_cache(maxsize=8192)
+def is_fuzzy_match(word: str, token: str) -> bool:
+    total = len(word) + len(token)
+    if total == 0:
+        return True  # SequenceMatcher rates two empty strings 1.0
+    if 2.0 * min(len(word), len(token)) / total < MATCH_RATIO:
+        return False
+    if 2.0 * sum((Counter(word) & Counter(token)).values()) / total < MATCH_RATIO:
+        return False
+    return SequenceMatcher(None, word, token).ratio() >= MATCH_RATIO
+
+# Every input word must closely match at least one of the result's words
+def has_strict_match(input_words: List[str], result_words: List[str]) -> bool:
+    return all(any(is_fuzzy_match(word, result_word) for result_word in result_words) for word in input_words)
+
+def refine_results(place_name: str, results: List[Dict[str, str]]) -> List[Dict[str, str]]:
     # Stop words to ignore in the root name
     ignore_words = {'the', 'of', 'and', 'in', 'at', 'on', 'for', 'by', 'with', 'about', 'from', 'to', 'up', 'out', 'as', 'into', 'near'}
 
     # First Pass: Filter out results that don't have at least 90% similarity with any of the user's input words
-    def has_strict_match(input_words: List[str], result_name: str) -> bool:
-        for word in input_words:
-            if all(SequenceMatcher(None, word.lower(), result_word).ratio() < 0.9 for result_word in split_name(result_name)):
-                return False
-        return True
-
+    # Names are tokenized once and the tokens reused by the second pass
     input_words = split_name(place_name)
-    filtered_results = [result for result in results if has_strict_match(input_words, result['name'])]
+    tokenized_results = [(result, split_name(result['name'])) for result in results]
+    matched = [(result, words) for result, words in tokenized_results if has_strict_match(input_words, words)]
+    filtered_results = [result for result, _ in matched]
 
     # Second Pass: Reduce names to root using common words
     if filtered_results:
-        all_names = [result['name'] for result in filtered_results]
-        split_names = [split_name(name) for name in all_names]
+        split_names = [words for _, words in matched]
         common_words = set(split_names[0])
-        for split_name in split_names[1:]:
-            common_words.intersection_update(split_name)
+        for words in split_names[1:]:
+            common_words.intersection_update(words)
 
         # Remove stop words from the common words set
         common_words.difference_update(ignore_words)
@@ -120,32 +411,54 @@ def refine_results(place_name: str, results: List[Dict[str, str]]) -> List[Dict[
     else:
         return []
 
-# Clustering nearby locations, to meters threshold
+# Clustering nearby locations, to meters threshold. Places are processed in order:
+# each place not yet merged seeds a cluster with every later unmerged place within
+# distance_threshold of it, and the cluster is reported at its averaged location.
+# Places are bucketed on a grid of threshold-sized cells, so each seed only
+# checks the 3x3 block of cells around it.
 def cluster_locations(places: List[Dict[str, str]], distance_threshold: float) -> List[Dict[str, str]]:
     clustered = []
     visited = set()
 
-    def is_near(p1, p2, threshold):
-        return haversine_distance((p1['lat'], p1['lng']), (p2['lat'], p2['lng'])) < threshold
-
     def get_place_id(place):
             return (place['lat'], place['lng'])
 
-    while places:
-        current_place = places.pop(0)
+    if not places:
+        return clustered
+
+    coords = np.array([get_place_id(place) for place in places], dtype=float)
+    # Any positive cell size works when nothing can be within the threshold
+    lat_step, lng_step = grid_steps(max(distance_threshold, 1.0), np.max(np.abs(coords[:, 0])))
+    n_cols = round(360.0 / lng_step)
+    rows = np.floor((coords[:, 0] + 90) / lat_step).astype(int)
+    cols = np.floor((coords[:, 1] + 180) / lng_step).astype(int) % n_cols
+
+    grid = defaultdict(list)
+    for i, cell in enumerate(zip(rows, cols)):
+        grid[cell].append(i)
+
+    merged = [False] * len(places)
+    for i, current_place in enumerate(places):
+        if merged[i]:
+            continue
+        merged[i] = True
         current_place_id = get_place_id(current_place)
         if current_place_id in visited:
             continue
         cluster = [current_place]
         visited.add(current_place_id)
-        places_to_remove = []
 
-        for other_place in places:
-            other_place_id = get_place_id(other_place)
-            if is_near(current_place, other_place, distance_threshold):
-                cluster.append(other_place)
-                visited.add(other_place_id)
-                places_to_remove.append(other_place)
+        neighbour_cells = {(rows[i] + d_row, (cols[i] + d_col) % n_cols)
+                           for d_row in (-1, 0, 1) for d_col in (-1, 0, 1)}
+        candidates = sorted(j for cell in neighbour_cells for j in grid.get(cell, ()) if not merged[j])
+
+        if candidates:
+            distances = haversine_to_many(current_place_id, coords[candidates])
+            for j, distance in zip(candidates, distances):
+                if distance < distance_threshold:
+                    cluster.append(places[j])
+                    visited.add(get_place_id(places[j]))
+                    merged[j] = True
 
         # Average the locations of the cluster
         avg_lat = sum(p['lat'] for p in cluster) / len(cluster)
@@ -156,8 +469,4 @@ def cluster_locations(places: List[Dict[str, str]], distance_threshold: float) -
             'lng': avg_lng,
         })
 
-        # Remove clustered places
-        for place in places_to_remove:
-            places.remove(place)
-
-    return clustered
\ No newline at end of file
+    return clustered
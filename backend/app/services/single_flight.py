@@ -0,0 +1,37 @@
+from concurrent.futures import Future
+import threading
+
+# Collapses concurrent calls with the same key into one execution: the first
+# caller runs fn, later callers block until it finishes and share its result
+# (or its exception). Nothing is remembered once the call completes, so there
+# is no staleness beyond the in-flight window.
+class SingleFlight:
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.calls = {}
+
+    def do(self, key, fn):
+        with self.lock:
+            call = self.calls.get(key)
+            leader = call is None
+            if leader:
+                call = self.calls[key] = Future()
+
+        if not leader:
+            return call.result()
+
+        try:
+            result = fn()
+        except BaseException as error:
+            call.set_exception(error)
+            raise
+        else:
+            call.set_result(result)
+            return result
+        finally:
+            with self.lock:
+                del self.calls[key]
+
+    def in_flight(self):
+        with self.lock:
+            return len(self.calls)
@@ -0,0 +1,130 @@
+from cachetools import TTLCache
+from flask import current_app
+from app.models import User
+import gzip, hashlib, threading
+import msgpack
+import numpy as np
+
+# Compact persistence for a user's searched places and clusters.
+# Places are stored once: a table of place types plus packed little-endian
+# arrays holding one type index and one (lat, lng) float64 pair per place.
+# Clusters refer to those places by index and keep their wcss, center and
+# radius, so saving new clusters rewrites a few bytes per place, not dicts.
+STATE_FORMAT_VERSION = 1
+
+def pack_places(places):
+    type_ids = {}
+    type_index = np.array([type_ids.setdefault(place['name'], len(type_ids)) for place in places], dtype='<u4')
+    coords = np.array([[place['lat'], place['lng']] for place in places], dtype='<f8').reshape(-1, 2)
+    return msgpack.packb({
+        'v': STATE_FORMAT_VERSION,
+        'types': list(type_ids),
+        'type_index': type_index.tobytes(),
+        'coords': coords.tobytes(),
+    })
+
+def unpack_places(data):
+    if not data:
+        return []
+    state = msgpack.unpackb(data)
+    types = state['types']
+    type_index = np.frombuffer(state['type_index'], dtype='<u4').tolist()
+    coords = np.frombuffer(state['coords'], dtype='<f8').reshape(-1, 2).tolist()
+    return [{'name': types[type_id], 'lat': lat, 'lng': lng} for type_id, (lat, lng) in zip(type_index, coords)]
+
+# Clusters as index references into places. Cluster places missing from places
+# (e.g. a /cluster payload that was not the saved search) are stored alongside.
+def pack_clusters(clusters, places):
+    index = {}
+    for i, place in enumerate(places):
+        index.setdefault((place['name'], place['lat'], place['lng']), i)
+
+    extra = []
+    rows = []
+    for cluster in clusters:
+        refs = []
+        for place in cluster['places']:
+            key = (place['name'], place['lat'], place['lng'])
+            if key not in index:
+                index[key] = len(places) + len(extra)
+                extra.append(place)
+            refs.append(index[key])
+        rows.append([int(cluster['cluster']), refs, float(cluster['wcss']),
+                     float(cluster['center']['lat']), float(cluster['center']['lng']), float(cluster['radius'])])
+
+    return msgpack.packb({
+        'v': STATE_FORMAT_VERSION,
+        'clusters': rows,
+        'extra': pack_places(extra) if extra else None,
+    })
+
+def unpack_clusters(data, places):
+    if not data:
+        return []
+    state = msgpack.unpackb(data)
+    places = places + unpack_places(state['extra'])
+    return [{
+        'cluster': cluster_id,
+        'places': [places[i] for i in refs],
+        'wcss': wcss,
+        'center': {'lat': center_lat, 'lng': center_lng},
+        'radius': radius
+    } for cluster_id, refs, wcss, center_lat, center_lng, radius in state['clusters']]
+
+# Saves a new search; clusters default to empty, clearing those of the previous search
+def save_user_search(user, places, search_center, search_radius, clusters=None):
+    user.places_data = pack_places(places)
+    user.clusters_data = pack_clusters(clusters or [], places)
+    user.search_center = search_center
+    user.search_radius = search_radius
+    user.state_version = (user.state_version or 0) + 1
+
+def save_user_clusters(user, clusters):
+    user.clusters_data = pack_clusters(clusters, unpack_places(user.places_data))
+    user.state_version = (user.state_version or 0) + 1
+
+# (searched_places, clusters) as the JSON lists the API returns
+def load_user_state(user):
+    places = unpack_places(user.places_data)
+    return places, unpack_clusters(user.clusters_data, places)
+
+# Serialized /latest-state bodies per (user, state_version), so unchanged state
+# is neither reloaded nor re-serialized. Bodies of at least GZIP_MIN_SIZE bytes
+# also keep a gzip-compressed copy.
+STATE_BLOB_CACHE_SIZE = 128
+STATE_BLOB_CACHE_TTL = 600  # seconds
+GZIP_MIN_SIZE = 1024  # bytes
+
+state_blob_cache = TTLCache(maxsize=STATE_BLOB_CACHE_SIZE, ttl=STATE_BLOB_CACHE_TTL)
+state_blob_cache_lock = threading.Lock()
+
+def state_etag(user_id, version):
+    return f'{hashlib.sha256(user_id.encode()).hexdigest()[:12]}-{version}'
+
+# The user's state_version without loading the packed state, or None for an unknown user
+def get_state_version(user_id):
+    return User.query.with_entities(User.state_version).filter_by(id=user_id).scalar()
+
+# (etag, json_body, gzip_body or None) for the user's latest state, or None for an unknown user
+def get_state_blob(user_id, version):
+    with state_blob_cache_lock:
+        blob = state_blob_cache.get((user_id, version))
+    if blob is not None:
+        return blob
+
+    user = User.query.filter_by(id=user_id).first()
+    if not user:
+        return None
+    searched_places, clusters = load_user_state(user)
+    body = current_app.json.dumps({
+        'clusters_state': clusters,
+        'searched_places_state': searched_places,
+        'center_state': user.search_center,
+        'radius_state': user.search_radius
+    }).encode()
+    compressed = gzip.compress(body, compresslevel=6) if len(body) >= GZIP_MIN_SIZE else None
+    blob = (state_etag(user_id, user.state_version), body, compressed)
+
+    with state_blob_cache_lock:
+        state_blob_cache[(user_id, user.state_version)] = blob
+    return blob
@@ -23,11 +23,14 @@ def calculate_bounding_box(center, radius):
 
     return northeast, southwest
 
-# Helper function to calculate the Haversine distance between two points
+EARTH_RADIUS_METERS = 6371000
+
+# Helper function to calculate the Haversine distance between two points.
+# Works element-wise, so the coordinates may also be broadcastable arrays.
 def haversine_distance(coord1, coord2):
     lat1, lon1 = coord1
     lat2, lon2 = coord2
-    R = 6371000  # Radius of the Earth in meters
+    R = EARTH_RADIUS_METERS  # Radius of the Earth in meters
     phi1, phi2 = np.radians(lat1), np.radians(lat2)
     delta_phi = np.radians(lat2 - lat1)
     delta_lambda = np.radians(lon2 - lon1)
@@ -36,3 +39,70 @@ def haversine_distance(coord1, coord2):
     c = 2 * np.arctan2(np.sqrt(a), np.sqrt(1 - a))
 
     return R * c
+
+# Latitude/longitude cell sizes in degrees for a grid in which any two points
+# closer than distance (haversine meters) fall in the same or adjacent cells,
+# for points with |lat| <= max_abs_lat. The longitude step divides 360 evenly
+# so column indices can wrap around the antimeridian.
+def grid_steps(distance, max_abs_lat):
+    half_angle = min(distance / (2 * EARTH_RADIUS_METERS), math.pi / 2)
+    lat_step = math.degrees(2 * half_angle) * 1.000001  # Small margin for float rounding
+
+    cos_lat = math.cos(math.radians(max_abs_lat))
+    if cos_lat <= math.sin(half_angle):
+        return lat_step, 360.0
+    lng_step = math.degrees(2 * math.asin(math.sin(half_angle) / cos_lat)) * 1.000001
+    return lat_step, 360.0 / max(1, math.floor(360.0 / lng_step))
+
+# Haversine distance in meters from one (lat, lng) point to each row of an (n, 2) array
+def haversine_to_many(point, coords):
+    coords = np.asarray(coords, dtype=float).reshape(-1, 2)
+    return haversine_distance(point, (coords[:, 0], coords[:, 1]))
+
+# Equirectangular projection of (lat, lng) rows into a local planar frame in meters,
+# as (east, north) offsets from origin (default: the centroid of the points).
+# Distortion stays well under 1% across a metro-sized search area.
+def project_to_local_frame(latlngs, origin=None):
+    latlngs = np.asarray(latlngs, dtype=float).reshape(-1, 2)
+    if origin is None:
+        origin = latlngs.mean(axis=0) if len(latlngs) else (0.0, 0.0)
+    lat0, lng0 = origin
+
+    east = EARTH_RADIUS_METERS * np.radians(latlngs[:, 1] - lng0) * np.cos(np.radians(lat0))
+    north = EARTH_RADIUS_METERS * np.radians(latlngs[:, 0] - lat0)
+    return np.column_stack((east, north))
+
+# Pairwise haversine distances between two (n, 2) / (m, 2) arrays, yielded as
+# (row_offset, block) pairs of at most chunk_size rows so memory stays O(chunk_size * m).
+# This and haversine_knn have no callers in the services, which work on planar
+# coordinates; benchmarks/check_haversine.py checks them against haversine_distance.
+def haversine_pairwise_chunks(coords_a, coords_b=None, chunk_size=1024):
+    coords_a = np.asarray(coords_a, dtype=float).reshape(-1, 2)
+    coords_b = coords_a if coords_b is None else np.asarray(coords_b, dtype=float).reshape(-1, 2)
+
+    for start in range(0, len(coords_a), chunk_size):
+        block = coords_a[start:start + chunk_size]
+        yield start, haversine_distance(
+            (block[:, None, 0], block[:, None, 1]),
+            (coords_b[None, :, 0], coords_b[None, :, 1])
+        )
+
+# k nearest rows of coords for every query row, by haversine distance.
+# Returns (distances, indices), both (len(queries), k) and sorted nearest first.
+def haversine_knn(queries, coords, k, chunk_size=1024):
+    queries = np.asarray(queries, dtype=float).reshape(-1, 2)
+    k = max(0, min(k, len(coords)))
+    distances = np.empty((len(queries), k))
+    indices = np.empty((len(queries), k), dtype=int)
+    if k <= 0:
+        return distances, indices
+
+    for start, block in haversine_pairwise_chunks(queries, coords, chunk_size):
+        nearest = np.argpartition(block, k - 1, axis=1)[:, :k]
+        nearest_distances = np.take_along_axis(block, nearest, axis=1)
+        order = np.argsort(nearest_distances, axis=1)
+        stop = start + len(block)
+        indices[start:stop] = np.take_along_axis(nearest, order, axis=1)
+        distances[start:stop] = np.take_along_axis(nearest_distances, order, axis=1)
+
+    return distances, indices
@@ -0,0 +1,194 @@
+"""Benchmarks for the clustering pipeline in app.services.cluster_service.
+
+Run from the backend directory:
+
+    python -m benchmarks.bench_clustering --output bench_results.json
+    python -m benchmarks.bench_clustering --baseline benchmarks/baseline.json
+    python -m benchmarks.bench_clustering --update-baseline benchmarks/baseline.json
+
+Each stage is timed (fastest of --repeat runs, which is the least noisy
+estimate) and its peak traced memory is recorded. With --baseline, a stage
+regresses when its time or peak memory exceeds the baseline value by more than
+a relative tolerance *and* by more than an absolute floor (SECONDS_FLOOR,
+PEAK_BYTES_FLOOR), so jitter on sub-millisecond stages does not fail the gate;
+the script then exits with status 1. Peak memory is deterministic and gated at
+--tolerance; wall time drifts by tens of percent between runs on a shared
+machine, so it is only gated at --seconds-tolerance (2x by default).
+
+kmeans_refinement runs until REFINEMENT_TIME_BUDGET (about 250 ms) expires on
+the larger inputs, so its time reflects the budget, not the code's speed; only
+its memory is gated (perform_clustering still gates the small inputs, where it
+finishes early). kmeans_fit times the KMeans fit on its own.
+"""
+import argparse, io, json, platform, sys, time, tracemalloc
+from contextlib import redirect_stdout
+import numpy as np
+from app.services import cluster_service
+from app.services.cluster_service import (
+    branch_and_bound_clustering, dbscan_clustering, nearest_neighbour_clustering,
+    kmeans_clustering, iterative_refinement, dynamic_max_clusters, evaluate_clusters, keeps_all_candidates,
+    perform_clustering, BRANCH_AND_BOUND_MAX_PLACES
+)
+from app.utils import project_to_local_frame
+
+SEATTLE = (47.608013, -122.335167)
+DEFAULT_TOLERANCE = 0.5  # 50% more peak memory than baseline counts as a regression...
+PEAK_BYTES_FLOOR = 64 * 1024  # ...when also at least 64 KiB more
+DEFAULT_SECONDS_TOLERANCE = 1.0  # Twice as slow as baseline counts as a regression...
+SECONDS_FLOOR = 0.005  # ...when also at least 5 ms slower
+BUDGET_BOUND_STAGES = {'kmeans_refinement'}  # Time set by a time budget; memory is still compared
+
+# Places spread uniformly over a square of +-spread degrees around center
+def uniform_places(n_types, per_type, spread=0.08, center=SEATTLE, seed=0):
+    rng = np.random.default_rng(seed)
+    places = []
+    for t in range(n_types):
+        for lat, lng in center + rng.uniform(-spread, spread, size=(per_type, 2)):
+            places.append({'name': f'Place {t}', 'lat': float(lat), 'lng': float(lng)})
+    return places
+
+# City-like layout: places of every type concentrate around shared hotspots
+def hotspot_places(n_types, per_type, n_hotspots=6, spread=0.08, hotspot_spread=0.006,
+                   center=SEATTLE, seed=0):
+    rng = np.random.default_rng(seed)
+    hotspots = center + rng.uniform(-spread, spread, size=(n_hotspots, 2))
+    places = []
+    for t in range(n_types):
+        picks = rng.integers(0, n_hotspots, size=per_type)
+        offsets = rng.normal(0, hotspot_spread, size=(per_type, 2))
+        for lat, lng in hotspots[picks] + offsets:
+            places.append({'name': f'Place {t}', 'lat': float(lat), 'lng': float(lng)})
+    return places
+
+SCENARIOS = [
+    {'name': 'uniform-3x5', 'layout': uniform_places, 'n_types': 3, 'per_type': 5},
+    {'name': 'hotspot-3x20', 'layout': hotspot_places, 'n_types': 3, 'per_type': 20},
+    {'name': 'uniform-3x20', 'layout': uniform_places, 'n_types': 3, 'per_type': 20},
+    {'name': 'hotspot-5x20', 'layout': hotspot_places, 'n_types': 5, 'per_type': 20},
+    {'name': 'uniform-5x60', 'layout': uniform_places, 'n_types': 5, 'per_type': 60},
+    {'name': 'hotspot-5x200', 'layout': hotspot_places, 'n_types': 5, 'per_type': 200},
+]
+
+# Returns {stage: callable} for one place set, mirroring run_strategies
+def build_stages(places):
+    place_names = [place['name'] for place in places]
+    place_latlngs = np.array([[place['lat'], place['lng']] for place in places])
+    place_types = set(place_names)
+    planar = project_to_local_frame(place_latlngs)
+    max_clusters = dynamic_max_clusters(len(place_latlngs), place_types)
+
+    candidates = (
+        dbscan_clustering(planar, places, place_types)
+        + nearest_neighbour_clustering(planar, places, place_types)
+    )
+
+    def end_to_end():
+        cluster_service.scored_cache.clear()
+        perform_clustering(places, place_names, place_latlngs, 0.5, deadline=60)
+
+    stages = {}
+    if len(places) <= BRANCH_AND_BOUND_MAX_PLACES:
+        stages['branch_and_bound'] = lambda: branch_and_bound_clustering(
+            place_latlngs, places, place_types, disjoint=not keeps_all_candidates(place_latlngs, place_types)
+        )
+    stages['dbscan'] = lambda: dbscan_clustering(planar, places, place_types)
+    stages['nearest_neighbour'] = lambda: nearest_neighbour_clustering(planar, places, place_types)
+    stages['kmeans_fit'] = lambda: kmeans_clustering(planar, max_clusters)
+    stages['kmeans_refinement'] = lambda: iterative_refinement(
+        kmeans_clustering(planar, max_clusters), places, place_types, planar=planar
+    )
+    stages['evaluate_clusters'] = lambda: evaluate_clusters(candidates, 0.5)
+    stages['perform_clustering'] = end_to_end
+    return stages
+
+# Fastest wall time over repeat runs, plus peak traced memory of one extra run.
+# The pipeline's own print output is discarded while measuring.
+def measure(stage, repeat):
+    with redirect_stdout(io.StringIO()):
+        return measure_quietly(stage, repeat)
+
+def measure_quietly(stage, repeat):
+    stage()  # Warm up imports and caches
+    timings = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        stage()
+        timings.append(time.perf_counter() - start)
+
+    tracemalloc.start()
+    stage()
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+
+    return {'seconds': min(timings), 'peak_bytes': peak}
+
+def run(repeat):
+    results = {}
+    for scenario in SCENARIOS:
+        places = scenario['layout'](scenario['n_types'], scenario['per_type'])
+        for stage_name, stage in build_stages(places).items():
+            key = f"{scenario['name']}/{stage_name}"
+            results[key] = measure(stage, repeat)
+            print(f"{key:45s} {results[key]['seconds'] * 1000:10.2f} ms {results[key]['peak_bytes'] / 1024:10.0f} KiB")
+    return results
+
+# Returns a list of human readable regressions against a baseline document
+def compare(results, baseline):
+    tolerances = {'seconds': baseline.get('seconds_tolerance', DEFAULT_SECONDS_TOLERANCE),
+                  'peak_bytes': baseline.get('tolerance', DEFAULT_TOLERANCE)}
+    floors = {'seconds': baseline.get('seconds_floor', SECONDS_FLOOR),
+              'peak_bytes': baseline.get('peak_bytes_floor', PEAK_BYTES_FLOOR)}
+    regressions = []
+    for key, expected in baseline['results'].items():
+        actual = results.get(key)
+        if actual is None:
+            continue
+        metrics = ('seconds', 'peak_bytes')
+        if key.split('/')[-1] in BUDGET_BOUND_STAGES:
+            metrics = ('peak_bytes',)
+        for metric in metrics:
+            limit = max(expected[metric] * (1 + tolerances[metric]), expected[metric] + floors[metric])
+            if actual[metric] > limit:
+                regressions.append(f'{key} {metric}: {actual[metric]:.6g} > {limit:.6g}')
+    return regressions
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Benchmark the clustering pipeline.')
+    parser.add_argument('--repeat', type=int, default=7)
+    parser.add_argument('--output', help='Write results as JSON to this path')
+    parser.add_argument('--baseline', help='Compare against this baseline JSON and fail on regressions')
+    parser.add_argument('--update-baseline', help='Write results as a new baseline to this path')
+    parser.add_argument('--tolerance', type=float, default=DEFAULT_TOLERANCE, help='Relative peak memory tolerance')
+    parser.add_argument('--seconds-tolerance', type=float, default=DEFAULT_SECONDS_TOLERANCE,
+                        help='Relative wall time tolerance')
+    args = parser.parse_args(argv)
+
+    results = run(args.repeat)
+    document = {
+        'python': platform.python_version(),
+        'numpy': np.__version__,
+        'tolerance': args.tolerance,
+        'seconds_tolerance': args.seconds_tolerance,
+        'seconds_floor': SECONDS_FLOOR,
+        'peak_bytes_floor': PEAK_BYTES_FLOOR,
+        'results': results,
+    }
+
+    if args.output:
+        with open(args.output, 'w') as file:
+            json.dump(document, file, indent=2)
+    if args.update_baseline:
+        with open(args.update_baseline, 'w') as file:
+            json.dump(document, file, indent=2)
+
+    if args.baseline:
+        with open(args.baseline) as file:
+            regressions = compare(results, json.load(file))
+        for regression in regressions:
+            print('REGRESSION', regression)
+        if regressions:
+            return 1
+    return 0
+
+if __name__ == '__main__':
+    sys.exit(main())
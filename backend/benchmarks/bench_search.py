@@ -0,0 +1,60 @@
+"""Times perform_search against the local stub Places server.
+
+Run from the backend directory:
+
+    python -m benchmarks.bench_search --latency 0.3
+
+Compares PLACES_MAX_CONCURRENCY=1 (one call at a time) with the configured
+concurrency, both over the shared keep-alive connection pool. The Places
+cache is bypassed so every run measures fetching: REDIS_URL is unset and the
+in-process cache is cleared before each timed run.
+"""
+import argparse, statistics, threading, time
+from flask import Flask
+from app.config import Config
+from app.services.search_service import perform_search
+from app.services import places_cache
+from tools.stub_places_server import create_server, SEARCH_PATH
+
+PLACE_NAMES = ['Starbucks', 'Chipotle', 'LA Fitness', 'Walgreens', 'Safeway']
+SEARCH_CENTER = {'lat': 47.608013, 'lng': -122.335167}
+SEARCH_RADIUS = 8046.7  # 5 miles in meters
+
+def time_search(app, concurrency, repeat):
+    app.config['PLACES_MAX_CONCURRENCY'] = concurrency
+    timings = []
+    with app.app_context():
+        for _ in range(repeat):
+            with places_cache.local_cache_lock:
+                places_cache.local_cache.clear()
+            start = time.perf_counter()
+            perform_search(PLACE_NAMES, SEARCH_CENTER, SEARCH_RADIUS, 20)
+            timings.append(time.perf_counter() - start)
+    return statistics.median(timings)
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark perform_search against the stub Places server.')
+    parser.add_argument('--latency', type=float, default=0.3)
+    parser.add_argument('--density', type=float, default=0.5, help='Stub places per query per lattice cell')
+    parser.add_argument('--repeat', type=int, default=3)
+    parser.add_argument('--concurrency', type=int, default=Config.PLACES_MAX_CONCURRENCY)
+    args = parser.parse_args()
+
+    server = create_server(port=0, latency=args.latency, density=args.density)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+
+    app = Flask(__name__)
+    app.config.from_object(Config)
+    app.config['GOOGLE_PLACES_API_KEY'] = 'stub'
+    app.config['GOOGLE_PLACES_API_URL'] = f'http://127.0.0.1:{server.server_address[1]}{SEARCH_PATH}'
+    app.config['REDIS_URL'] = None  # No shared cache between runs
+
+    serial = time_search(app, 1, args.repeat)
+    concurrent = time_search(app, args.concurrency, args.repeat)
+    print(f'{len(PLACE_NAMES)} place names, {args.latency * 1000:.0f} ms upstream latency')
+    print(f'concurrency 1: {serial * 1000:8.1f} ms')
+    print(f'concurrency {args.concurrency}: {concurrent * 1000:8.1f} ms ({serial / concurrent:.1f}x)')
+    server.shutdown()
+
+if __name__ == '__main__':
+    main()
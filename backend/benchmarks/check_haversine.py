@@ -0,0 +1,97 @@
+"""Check the array haversine kernels in app.utils against haversine_distance.
+
+haversine_to_many, haversine_pairwise_chunks and haversine_knn are compared
+with the scalar haversine_distance on random points, including chunk sizes
+that split the input unevenly, k larger than the number of points and empty
+inputs. Prints each failed check and exits with status 1 if any fail. Run from
+the backend directory:
+
+    python -m benchmarks.check_haversine
+"""
+import sys
+import numpy as np
+from app.utils import haversine_distance, haversine_to_many, haversine_pairwise_chunks, haversine_knn
+
+TOLERANCE_METERS = 1e-6
+
+# Random (lat, lng) rows scattered around Seattle, with a few far away points
+def random_coords(rng, count):
+    coords = rng.normal((47.6, -122.3), 0.05, size=(count, 2))
+    coords[::7] = rng.uniform((-80, -180), (80, 180), size=(len(coords[::7]), 2))
+    return coords
+
+# Pairwise distances from the scalar helper, one pair at a time
+def reference_pairwise(coords_a, coords_b):
+    return np.array([[haversine_distance(tuple(a), tuple(b)) for b in coords_b] for a in coords_a]).reshape(len(coords_a), len(coords_b))
+
+def assembled_pairwise(coords_a, coords_b=None, chunk_size=1024):
+    width = len(coords_a if coords_b is None else coords_b)
+    blocks = [block for _, block in haversine_pairwise_chunks(coords_a, coords_b, chunk_size)]
+    return np.vstack(blocks) if blocks else np.empty((0, width))
+
+def check_to_many(rng, failures):
+    coords = random_coords(rng, 50)
+    point = tuple(coords[0])
+    expected = reference_pairwise([point], coords)[0]
+    if not np.allclose(haversine_to_many(point, coords), expected, rtol=0, atol=TOLERANCE_METERS):
+        failures.append('haversine_to_many differs from haversine_distance')
+    if haversine_to_many(point, np.empty((0, 2))).shape != (0,):
+        failures.append('haversine_to_many with no coords is not empty')
+
+def check_pairwise(rng, failures):
+    coords_a, coords_b = random_coords(rng, 23), random_coords(rng, 11)
+    expected = reference_pairwise(coords_a, coords_b)
+    for chunk_size in (1, 5, 23, 1024):
+        actual = assembled_pairwise(coords_a, coords_b, chunk_size)
+        if actual.shape != expected.shape or not np.allclose(actual, expected, rtol=0, atol=TOLERANCE_METERS):
+            failures.append(f'haversine_pairwise_chunks differs at chunk_size={chunk_size}')
+
+    if not np.allclose(assembled_pairwise(coords_a, chunk_size=4), reference_pairwise(coords_a, coords_a),
+                       rtol=0, atol=TOLERANCE_METERS):
+        failures.append('haversine_pairwise_chunks without coords_b differs from self distances')
+
+    empty = np.empty((0, 2))
+    for name, actual, shape in (
+        ('no rows', assembled_pairwise(empty, coords_b), (0, len(coords_b))),
+        ('no columns', assembled_pairwise(coords_a, empty), (len(coords_a), 0)),
+        ('no points', assembled_pairwise(empty), (0, 0)),
+    ):
+        if actual.shape != shape:
+            failures.append(f'haversine_pairwise_chunks with {name} has shape {actual.shape}, expected {shape}')
+
+def check_knn(rng, failures):
+    queries, coords = random_coords(rng, 17), random_coords(rng, 30)
+    expected = reference_pairwise(queries, coords)
+    for k, chunk_size in ((1, 1024), (4, 5), (30, 3), (50, 1024)):
+        distances, indices = haversine_knn(queries, coords, k, chunk_size)
+        expected_k = np.sort(expected, axis=1)[:, :min(k, len(coords))]
+        if distances.shape != expected_k.shape or not np.allclose(distances, expected_k, rtol=0, atol=TOLERANCE_METERS):
+            failures.append(f'haversine_knn distances differ at k={k}, chunk_size={chunk_size}')
+        elif not np.allclose(np.take_along_axis(expected, indices, axis=1), distances, rtol=0, atol=TOLERANCE_METERS):
+            failures.append(f'haversine_knn indices do not match their distances at k={k}, chunk_size={chunk_size}')
+
+    empty = np.empty((0, 2))
+    for name, args, shape in (
+        ('no queries', (empty, coords, 3), (0, 3)),
+        ('no coords', (queries, empty, 3), (len(queries), 0)),
+        ('k=0', (queries, coords, 0), (len(queries), 0)),
+    ):
+        distances, indices = haversine_knn(*args)
+        if distances.shape != shape or indices.shape != shape:
+            failures.append(f'haversine_knn with {name} has shape {distances.shape}, expected {shape}')
+
+def main():
+    rng = np.random.default_rng(0)
+    failures = []
+    check_to_many(rng, failures)
+    check_pairwise(rng, failures)
+    check_knn(rng, failures)
+
+    for failure in failures:
+        print(f'FAILED: {failure}')
+    if failures:
+        sys.exit(1)
+    print('haversine kernels match haversine_distance')
+
+if __name__ == '__main__':
+    main()
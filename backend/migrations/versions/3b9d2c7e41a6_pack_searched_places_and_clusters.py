@@ -0,0 +1,130 @@
+"""pack searched places and clusters
+
+Revision ID: 3b9d2c7e41a6
+Revises: e35d5f5c8bed
+Create Date: 2026-10-18 10:12:44.318206
+
+"""
+from alembic import op
+import sqlalchemy as sa
+import msgpack
+import numpy as np
+
+
+# revision identifiers, used by Alembic.
+revision = '3b9d2c7e41a6'
+down_revision = 'e35d5f5c8bed'
+branch_labels = None
+depends_on = None
+
+
+# Version 1 of the packed format, frozen here so later changes to
+# app.services.state_service cannot change what this migration writes or reads.
+def pack_places(places):
+    type_ids = {}
+    type_index = np.array([type_ids.setdefault(place['name'], len(type_ids)) for place in places], dtype='<u4')
+    coords = np.array([[place['lat'], place['lng']] for place in places], dtype='<f8').reshape(-1, 2)
+    return msgpack.packb({
+        'v': 1,
+        'types': list(type_ids),
+        'type_index': type_index.tobytes(),
+        'coords': coords.tobytes(),
+    })
+
+
+def unpack_places(data):
+    if not data:
+        return []
+    state = msgpack.unpackb(data)
+    types = state['types']
+    type_index = np.frombuffer(state['type_index'], dtype='<u4').tolist()
+    coords = np.frombuffer(state['coords'], dtype='<f8').reshape(-1, 2).tolist()
+    return [{'name': types[type_id], 'lat': lat, 'lng': lng} for type_id, (lat, lng) in zip(type_index, coords)]
+
+
+def pack_clusters(clusters, places):
+    index = {}
+    for i, place in enumerate(places):
+        index.setdefault((place['name'], place['lat'], place['lng']), i)
+
+    extra = []
+    rows = []
+    for cluster in clusters:
+        refs = []
+        for place in cluster['places']:
+            key = (place['name'], place['lat'], place['lng'])
+            if key not in index:
+                index[key] = len(places) + len(extra)
+                extra.append(place)
+            refs.append(index[key])
+        rows.append([int(cluster['cluster']), refs, float(cluster['wcss']),
+                     float(cluster['center']['lat']), float(cluster['center']['lng']), float(cluster['radius'])])
+
+    return msgpack.packb({
+        'v': 1,
+        'clusters': rows,
+        'extra': pack_places(extra) if extra else None,
+    })
+
+
+def unpack_clusters(data, places):
+    if not data:
+        return []
+    state = msgpack.unpackb(data)
+    places = places + unpack_places(state['extra'])
+    return [{
+        'cluster': cluster_id,
+        'places': [places[i] for i in refs],
+        'wcss': wcss,
+        'center': {'lat': center_lat, 'lng': center_lng},
+        'radius': radius
+    } for cluster_id, refs, wcss, center_lat, center_lng, radius in state['clusters']]
+
+
+user_table = sa.table('user',
+    sa.column('id', sa.String()),
+    sa.column('searched_places', sa.JSON()),
+    sa.column('clusters', sa.JSON()),
+    sa.column('places_data', sa.LargeBinary()),
+    sa.column('clusters_data', sa.LargeBinary()),
+)
+
+
+def upgrade():
+    with op.batch_alter_table('user', schema=None) as batch_op:
+        batch_op.add_column(sa.Column('places_data', sa.LargeBinary(), nullable=True))
+        batch_op.add_column(sa.Column('clusters_data', sa.LargeBinary(), nullable=True))
+
+    connection = op.get_bind()
+    rows = connection.execute(sa.select(user_table.c.id, user_table.c.searched_places, user_table.c.clusters)).all()
+    for user_id, searched_places, clusters in rows:
+        searched_places = searched_places or []
+        connection.execute(user_table.update().where(user_table.c.id == user_id).values(
+            places_data=pack_places(searched_places),
+            clusters_data=pack_clusters(clusters or [], searched_places)
+        ))
+
+    with op.batch_alter_table('user', schema=None) as batch_op:
+        batch_op.drop_column('clusters')
+        batch_op.drop_column('searched_places')
+
+
+def downgrade():
+    with op.batch_alter_table('user', schema=None) as batch_op:
+        batch_op.add_column(sa.Column('searched_places', sa.JSON(), nullable=True))
+        batch_op.add_column(sa.Column('clusters', sa.JSON(), nullable=True))
+
+    connection = op.get_bind()
+    rows = connection.execute(sa.select(user_table.c.id, user_table.c.places_data, user_table.c.clusters_data)).all()
+    for user_id, places_data, clusters_data in rows:
+        searched_places = unpack_places(places_data)
+        connection.execute(user_table.update().where(user_table.c.id == user_id).values(
+            searched_places=searched_places,
+            clusters=unpack_clusters(clusters_data, searched_places)
+        ))
+
+    with op.batch_alter_table('user', schema=None) as batch_op:
+        batch_op.alter_column('searched_places', existing_type=sa.JSON(), nullable=False)
+        batch_op.alter_column('clusters', existing_type=sa.JSON(), nullable=False)
+        batch_op.drop_column('clusters_data')
+        batch_op.drop_column('places_data')
@@ -0,0 +1,26 @@
+"""add state version to user
+
+Revision ID: 7c41e9a2d5f3
+Revises: 3b9d2c7e41a6
+Create Date: 2026-10-18 11:03:27.905114
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '7c41e9a2d5f3'
+down_revision = '3b9d2c7e41a6'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    with op.batch_alter_table('user', schema=None) as batch_op:
+        batch_op.add_column(sa.Column('state_version', sa.Integer(), nullable=False, server_default='0'))
+
+
+def downgrade():
+    with op.batch_alter_table('user', schema=None) as batch_op:
+        batch_op.drop_column('state_version')
@@ -0,0 +1,92 @@
+"""Local stand-in for the Places API (New) Text Search endpoint.
+
+Serves deterministic fake places inside the requested rectangle, after an
+optional artificial latency, so the search pipeline can be exercised and
+timed offline. Places sit on a fixed lattice of CELL_DEGREES cells, so
+overlapping rectangles (e.g. quadtree tiles) see the same places. Like the
+real API, results come in pages of pageSize with a nextPageToken, up to
+MAX_RESULTS per query. Run from the backend directory:
+
+    python -m tools.stub_places_server --port 8765 --latency 0.3 --density 0.5
+
+then start the app with
+GOOGLE_PLACES_API_URL=http://127.0.0.1:8765/v1/places:searchText.
+"""
+import argparse, hashlib, json, math, random, time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+SEARCH_PATH = '/v1/places:searchText'
+CELL_DEGREES = 0.01
+MAX_RESULTS = 60
+
+# Fake places for a query inside a rectangle. Each lattice cell holds places
+# seeded by (query, cell), with density places per cell on average.
+def fake_places(text_query, rectangle, density):
+    low, high = rectangle['low'], rectangle['high']
+    places = []
+    for row in range(math.floor(low['latitude'] / CELL_DEGREES), math.floor(high['latitude'] / CELL_DEGREES) + 1):
+        for col in range(math.floor(low['longitude'] / CELL_DEGREES), math.floor(high['longitude'] / CELL_DEGREES) + 1):
+            seed = hashlib.sha256(f'{text_query.lower()}|{row}|{col}'.encode()).hexdigest()
+            rng = random.Random(seed)
+            count = int(density) + (rng.random() < density % 1)
+            for i in range(count):
+                lat = (row + rng.random()) * CELL_DEGREES
+                lng = (col + rng.random()) * CELL_DEGREES
+                if low['latitude'] <= lat <= high['latitude'] and low['longitude'] <= lng <= high['longitude']:
+                    places.append({
+                        'displayName': {'text': text_query.title()},
+                        'location': {'latitude': lat, 'longitude': lng}
+                    })
+    return places
+
+def make_handler(latency, density):
+    class StubPlacesHandler(BaseHTTPRequestHandler):
+        protocol_version = 'HTTP/1.1'  # Keep-alive, like the real API
+
+        def do_POST(self):
+            body = self.rfile.read(int(self.headers.get('Content-Length', 0)))
+            if self.path != SEARCH_PATH:
+                return self.reply(404, {'error': {'message': 'Not found'}})
+            try:
+                request = json.loads(body)
+                text_query = request['textQuery']
+                rectangle = request['locationRestriction']['rectangle']
+            except (ValueError, KeyError):
+                return self.reply(400, {'error': {'message': 'Invalid request'}})
+
+            time.sleep(latency)
+            places = fake_places(text_query, rectangle, density)[:MAX_RESULTS]
+            page_size = min(request.get('pageSize', 20), 20)
+            offset = int(request.get('pageToken') or 0)
+            response = {'places': places[offset:offset + page_size]}
+            if offset + page_size < len(places):
+                response['nextPageToken'] = str(offset + page_size)
+            self.reply(200, response)
+
+        def reply(self, status, payload):
+            data = json.dumps(payload).encode()
+            self.send_response(status)
+            self.send_header('Content-Type', 'application/json')
+            self.send_header('Content-Length', str(len(data)))
+            self.end_headers()
+            self.wfile.write(data)
+
+        def log_message(self, format, *args):
+            pass  # Keep benchmark output readable
+
+    return StubPlacesHandler
+
+def create_server(host='127.0.0.1', port=8765, latency=0.3, density=0.5):
+    return ThreadingHTTPServer((host, port), make_handler(latency, density))
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Stub Places API Text Search server.')
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=8765)
+    parser.add_argument('--latency', type=float, default=0.3, help='Seconds to wait before each response')
+    parser.add_argument('--density', type=float, default=0.5, help='Average places per query per lattice cell')
+    args = parser.parse_args()
+
+    server = create_server(args.host, args.port, args.latency, args.density)
+    print(f'Stub Places API listening on http://{args.host}:{args.port}{SEARCH_PATH}')
+    server.serve_forever()